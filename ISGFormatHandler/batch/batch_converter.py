@@ -0,0 +1,276 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from ..model.model import Model
+
+OUTPUT_FORMATS = ('isg1.01', 'isg2.00', 'csv', 'csv.gz', 'gsf', 'tif', 'gri', 'gtx', 'bin')
+PLOT_MODES = ('full', 'preview', 'none')
+INTERPOLATION_METHODS = ('nn', 'bl', 'bc')
+# Keys of a job; a manifest entry sets any of them next to its 'input' path or glob
+JOB_DEFAULTS = {
+    'formats': [],
+    'output_dir': '.',
+    'bounds': None,
+    'shapefile': None,
+    'interpolation': None,
+    'convert_shapefile_to_bounds': False,
+    'optimize_dimensions': True,
+    'plot': None,
+    'memory_budget': None,
+}
+# Job paths that a manifest gives relative to its own directory
+MANIFEST_PATHS = ('input', 'output_dir', 'shapefile')
+MEGABYTE = 1 << 20
+
+
+def expand_input(pattern):
+    # A pattern without matches is kept as it is, so that the missing file is reported as a failed job
+    return sorted(glob.glob(os.path.expanduser(pattern), recursive=True)) or [pattern]
+
+
+def check_job(job):
+    if not job['formats']:
+        raise ValueError('No output format given for {}'.format(job['input']))
+    for output_format in job['formats']:
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError('Unknown output format {!r}, expected one of {}'.format(output_format, ', '.join(OUTPUT_FORMATS)))
+    if job['plot'] not in PLOT_MODES + (None,):
+        raise ValueError('Unknown plot mode {!r}, expected one of {}'.format(job['plot'], ', '.join(PLOT_MODES)))
+    if job['interpolation'] is not None and job['interpolation'].get('method') not in INTERPOLATION_METHODS:
+        raise ValueError('Unknown interpolation method {!r}, expected one of {}'.format(
+            job['interpolation'].get('method'), ', '.join(INTERPOLATION_METHODS)
+        ))
+    if job['memory_budget'] is not None and job['memory_budget'] <= 0:
+        raise ValueError('memory_budget must be a positive number of megabytes, got {}'.format(job['memory_budget']))
+
+
+def read_manifest(path):
+    with open(path) as f:
+        entries = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    for entry in entries:
+        for key in MANIFEST_PATHS:
+            if entry.get(key) is not None:
+                entry[key] = os.path.normpath(os.path.join(base, os.path.expanduser(entry[key])))
+    return entries
+
+
+def build_jobs(inputs, manifest=None, defaults=None):
+    # One job per input file; manifest entries override the defaults (the command line options) key by key
+    entries = [{'input': pattern} for pattern in inputs]
+    if manifest is not None:
+        entries += read_manifest(manifest)
+
+    jobs = []
+    for entry in entries:
+        if 'input' not in entry:
+            raise ValueError('Manifest entry {} has no input'.format(entry))
+        unknown = set(entry) - set(JOB_DEFAULTS) - {'input'}
+        if unknown:
+            raise ValueError('Unknown job keys {} in {}'.format(', '.join(sorted(unknown)), entry['input']))
+        for path in expand_input(entry['input']):
+            job = dict(JOB_DEFAULTS, **(defaults or {}))
+            job.update(entry)
+            job['input'] = path
+            if isinstance(job['formats'], str):
+                job['formats'] = [job['formats']]
+            if job['plot'] == 'none':
+                job['plot'] = None
+            check_job(job)
+            jobs.append(job)
+    return jobs
+
+
+def preload(job):
+    # The plotting, shapefile and GeoTIFF dependencies are imported in the job's process before it is timed, so the
+    # per-file time does not include their import
+    if job['plot'] is not None:
+        from ..model import plotting
+    if job['shapefile'] is not None:
+        import geopandas
+        import rasterio.features
+    if 'tif' in job['formats'] or os.path.splitext(job['input'])[1].lower() in ['.tif', '.tiff']:
+        import rasterio.shutil
+
+
+def peak_rss() -> int:
+    # Peak resident memory of the process in bytes, memory maps and GDAL buffers included. It is a high water mark,
+    # so every job runs in a process of its own
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def run_job(job):
+    # Runs in a worker process: times the job, reads its peak resident memory and reports a failure instead of raising
+    result = {'input': job['input'], 'outputs': [], 'error': None}
+    try:
+        preload(job)
+    except ImportError as e:
+        result.update(error='{}: {}'.format(type(e).__name__, e), seconds=0.0, peak_memory=peak_rss())
+        return result
+
+    start = time.perf_counter()
+    try:
+        # ISG files are opened lazily, so a subset by bounds decodes only the rows it keeps
+        model = Model()
+        options = {'lazy': True} if os.path.splitext(job['input'])[1].lower() == '.isg' else {}
+        model.importFrom(job['input'], **options)
+        if job['memory_budget'] is not None:
+            model.memory_budget = int(job['memory_budget'] * MEGABYTE)
+
+        # Each input gets its own directory, as createSubmodel writes plot.png next to the converted files
+        directory = os.path.join(job['output_dir'], os.path.splitext(os.path.basename(job['input']))[0])
+        os.makedirs(directory, exist_ok=True)
+
+        submodel = model.getSubmodel(
+            job['bounds'], job['shapefile'], job['interpolation'], job['convert_shapefile_to_bounds'], job['optimize_dimensions']
+        )
+        if job['plot'] == 'full':
+            submodel.plot(path=directory, show=False)
+        elif job['plot'] == 'preview':
+            from ..model.plotting import render_preview
+            render_preview(submodel, os.path.join(directory, 'plot.png'))
+        for output_format in job['formats']:
+            result['outputs'].append(submodel.convertTo(directory, output_format))
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    result['seconds'] = time.perf_counter() - start
+    result['peak_memory'] = peak_rss()
+    return result
+
+
+def read_headers(paths):
+    # Header metadata of every ISG file, read without its grid; a file that cannot be read gives its error instead
+    for path in paths:
+        try:
+            yield Model().readHeader(path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            yield {'file_path': path, 'error': '{}: {}'.format(type(e).__name__, e)}
+
+
+def run_isolated(job):
+    # A new process per job, started from a fork server (or spawned) rather than forked from this threaded one
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context(start_method)) as executor:
+        return executor.submit(run_job, job).result()
+
+
+def iter_results(jobs, workers=1):
+    # Yields the job results in completion order. Each job runs in a process of its own, so that its peak memory is
+    # not that of an earlier, larger job; the threads only wait for up to workers of those processes at once
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_isolated, job): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                # e.g. a worker killed by the system while reading a large grid
+                yield {
+                    'input': futures[future]['input'], 'outputs': [], 'error': '{}: {}'.format(type(e).__name__, e),
+                    'seconds': None, 'peak_memory': None
+                }
+
+
+def format_result(index, total, result):
+    width = len(str(total))
+    if result['seconds'] is None:
+        return '[{:>{}}/{}] FAILED {}\n    {}'.format(index, width, total, result['input'], result['error'])
+    line = '[{:>{}}/{}] {} {:8.2f} s {:9.1f} MB  {}'.format(
+        index, width, total, 'FAILED' if result['error'] else 'ok    ', result['seconds'],
+        result['peak_memory'] / MEGABYTE, result['input']
+    )
+    if result['error']:
+        line += '\n    ' + result['error']
+    return line
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m ISGFormatHandler',
+        description='Convert, subset and resample many geoid models in parallel.'
+    )
+    parser.add_argument('inputs', nargs='*', help='model files or glob patterns (isg, tif, gri, gsf, gtx, bin)')
+    parser.add_argument('-m', '--manifest', help='JSON list of jobs: objects with an "input" path or glob and any of '
+                                                 + ', '.join(JOB_DEFAULTS) + '; they override the options below')
+    parser.add_argument('-f', '--format', dest='formats', action='append', choices=OUTPUT_FORMATS, default=[],
+                        help='output format, can be repeated')
+    parser.add_argument('-o', '--output-dir', default='.', help='a directory per input file is created in it')
+    parser.add_argument('--bounds', nargs=4, type=float, metavar=('LAT_MIN', 'LAT_MAX', 'LON_MIN', 'LON_MAX'),
+                        help='sub-model bounds in decimal degrees')
+    parser.add_argument('--shapefile', help='sub-model shapefile')
+    parser.add_argument('--shapefile-to-bounds', action='store_true', help='cut the sub-model to the shapefile bounds')
+    parser.add_argument('--no-optimize-dimensions', action='store_true',
+                        help='pad the sub-model with nodata until it covers the requested bounds')
+    parser.add_argument('--resample', nargs=2, type=float, metavar=('LAT_DEG', 'LON_DEG'), help='resample to this spacing')
+    parser.add_argument('--method', choices=INTERPOLATION_METHODS, default='bl',
+                        help='resampling method: nearest-neighbor, linear or cubic (default: bl)')
+    parser.add_argument('--plot', choices=PLOT_MODES, default='none', help='plot written next to the converted files')
+    parser.add_argument('--memory-budget', type=float, metavar='MB',
+                        help='about the memory a row block may take while an ISG file is streamed (default: 256)')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count(), help='worker processes (default: CPU count)')
+    parser.add_argument('--report', help='write the per-file timings, peak memory and outputs to this JSON file')
+    parser.add_argument('--headers', action='store_true',
+                        help='only print the header metadata of every ISG input as JSON lines, without reading the grids')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.inputs and args.manifest is None:
+        parser.error('no input files or manifest given')
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    if args.headers:
+        patterns = list(args.inputs)
+        if args.manifest is not None:
+            patterns += [entry['input'] for entry in read_manifest(args.manifest) if 'input' in entry]
+        failed = 0
+        for metadata in read_headers(path for pattern in patterns for path in expand_input(pattern)):
+            failed += 'error' in metadata
+            print(json.dumps(metadata, ensure_ascii=False), flush=True)
+        return 1 if failed else 0
+
+    defaults = {
+        'formats': args.formats,
+        'output_dir': args.output_dir,
+        'bounds': dict(zip(['lat_min', 'lat_max', 'lon_min', 'lon_max'], args.bounds)) if args.bounds else None,
+        'shapefile': args.shapefile,
+        'interpolation': {'lat_deg': args.resample[0], 'lon_deg': args.resample[1], 'method': args.method} if args.resample else None,
+        'convert_shapefile_to_bounds': args.shapefile_to_bounds,
+        'optimize_dimensions': not args.no_optimize_dimensions,
+        'plot': args.plot,
+        'memory_budget': args.memory_budget,
+    }
+    try:
+        jobs = build_jobs(args.inputs, args.manifest, defaults)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if not jobs:
+        parser.error('the manifest has no jobs')
+
+    workers = min(args.workers, len(jobs))
+    start = time.perf_counter()
+    results = []
+    for result in iter_results(jobs, workers):
+        results.append(result)
+        print(format_result(len(results), len(jobs), result), flush=True)
+    wall_time = time.perf_counter() - start
+
+    failed = sum(result['error'] is not None for result in results)
+    job_time = sum(result['seconds'] or 0 for result in results)
+    print('{} files in {:.2f} s with {} workers ({:.2f} s of job time), {} failed'.format(
+        len(results), wall_time, workers, job_time, failed
+    ))
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump({'workers': workers, 'seconds': wall_time, 'jobs': results}, f, indent=2)
+    return 1 if failed else 0
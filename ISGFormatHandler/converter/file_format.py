@@ -1,11 +1,23 @@
+import copy
 import csv
+import gzip
+import json
 import math
+import os
 import re
 import struct
 from datetime import date
-import rasterio
 import numpy as np
 
+from ..model.config import NODATA_THRESHOLD, NODATA_VALUE
+from ..model.head_schema import HEAD_SCHEMAS
+
+GTX_NODATA_VALUE = -88.8888
+BIN_ALIGNMENT = 64
+TIF_COMPRESSIONS = ('deflate', 'lzw', 'zstd')
+# GDAL COG driver names for the TIFF predictor tag values
+COG_PREDICTORS = {1: 'NO', 2: 'STANDARD', 3: 'FLOATING_POINT'}
+
 
 def deg_to_dms_dict(dd):
     is_positive = dd >= 0
@@ -30,48 +42,66 @@ def string_dms_to_dict(string_dms):
 
 
 def fillSpaces(string, length, align='left', right_space=False) -> str:
-    while len(string) < length:
-        if align == 'left':
-            string = string + ' '
-        if align == 'right':
-            string = ' ' + string
+    if align == 'left':
+        string = string.ljust(length)
+    if align == 'right':
+        string = string.rjust(length)
     if right_space:
         string = string + ' '
     return string
 
 
 def listToString(array, item_format, item_space, right_space=False) -> str:
-    string = ''
-    for item in array:
-        string = string + fillSpaces(('{' + item_format + '}').format(item), item_space, 'right', right_space)
-    return string
+    item_template = '{' + item_format + '}'
+    return ''.join(fillSpaces(item_template.format(item), item_space, 'right', right_space) for item in array)
+
+
+def blockToString(block, item_format, right_space=False) -> str:
+    # Formats a block of rows in one call, one line per row; the width in item_format pads each value
+    item_template = '{' + item_format + '}' + (' ' if right_space else '')
+    row_template = item_template * block.shape[1] + '\n'
+    return (row_template * block.shape[0]).format(*block.ravel().tolist())
+
+
+def overviewFactors(shape, blocksize) -> list:
+    # Halve the raster until the coarsest overview fits in a single tile
+    factors = []
+    factor = 2
+    while max(shape) / (factor // 2) > blocksize:
+        factors.append(factor)
+        factor *= 2
+    return factors
 
 
 class FileFormat:
 
-    def __init__(self, model, saved_file):
+    def __init__(self, model, saved_file, blocks=None):
         self.model = model
         self.saved_file = saved_file
+        self.blocks = blocks
+
+    def iterRowBlocks(self, rows_per_block=None):
+        # The (first row, block) pairs handed in by convertToMany, which walks the grid once for several formats,
+        # or the model's own blocks
+        if self.blocks is not None:
+            return self.blocks
+        return self.model.iterRowBlocks(rows_per_block)
 
     def convertToISG(self, version='1.01'):
+        # Work on a private copy so that exporting never changes the model itself
+        head = copy.deepcopy(self.model.head)
+
         # Set requested version as model version
-        self.model.head['isg_format']['value'] = version
-
-        # Grid shift
-        if version == '1.01':
-            self.model.head['lat_min']['value'] = float(self.model.dd_bounds['lat_min']) - float(
-                self.model.dd_bounds['delta_lat']) / 2
-            self.model.head['lat_max']['value'] = float(self.model.dd_bounds['lat_max']) + float(
-                self.model.dd_bounds['delta_lat']) / 2
-            self.model.head['lon_min']['value'] = float(self.model.dd_bounds['lon_min']) - float(self.model.dd_bounds['delta_lon']) / 2
-            self.model.head['lon_max']['value'] = float(self.model.dd_bounds['lon_max']) + float(self.model.dd_bounds['delta_lon']) / 2
-
-        # Find delimiter position
-        version_structure = self.model.getStructureByVersion(version)
-        delimiter_position = 1
-        for key, value in version_structure.items():
-            if len(value['keyword']) > delimiter_position:
-                delimiter_position = len(value['keyword'])
+        head['isg_format']['value'] = version
+
+        # Grid shift: ISG 1.x headers give the outer cell edges instead of the outer nodes
+        bounds = self.model.geometry.getBounds('cell' if version in ['1.0', '1.01'] else 'node')
+        if version in ['1.0', '1.01']:
+            for slug in ['lat_min', 'lat_max', 'lon_min', 'lon_max']:
+                head[slug]['value'] = bounds[slug]
+
+        schema = HEAD_SCHEMAS[version]
+        delimiter_position = schema.keyword_width
 
         with open(self.saved_file, 'w') as file:
 
@@ -80,23 +110,23 @@ class FileFormat:
             file.write('begin_of_head ================================================\n')
 
             coord_units = None
-            for slug, item in self.model.head.items():
+            for slug, item in head.items():
                 if slug == 'coord_units':
                     coord_units = item['value']
                     break
             if coord_units is None:
                 coord_units = 'deg'
 
-            for slug, item in self.model.getStructureByVersion(version).items():
+            for slug, item in schema.fields.items():
 
-                if slug in self.model.head:
+                if slug in head:
 
                     if slug == 'model_name' and self.model.is_subset:
-                        self.model.head[slug]['value'] += ' subset'
+                        head[slug]['value'] += ' subset'
 
-                    if self.model.head[slug]['type'] == 'numeric':
+                    if head[slug]['type'] == 'numeric':
                         delimiter = ' = '
-                        destination_format = item['format']
+                        destination_format = item.format
 
                         if isinstance(destination_format, dict) and coord_units in destination_format:
                             destination_format = destination_format[coord_units]
@@ -105,40 +135,40 @@ class FileFormat:
                                 string = '{' + destination_format['d'] + '}°{' + destination_format['m'] + '}\'{' + \
                                          destination_format['s'] + '}"'
 
-                                if type(self.model.head[slug]['value']) == str:
-                                    dms = string_dms_to_dict(self.model.head[slug]['value'])
+                                if type(head[slug]['value']) == str:
+                                    dms = string_dms_to_dict(head[slug]['value'])
                                 else:
-                                    dms = deg_to_dms_dict(self.model.head[slug]['value'])
+                                    dms = deg_to_dms_dict(head[slug]['value'])
 
                                 string = string.format(dms[0], dms[1], dms[2])[1:]
 
                             else:
                                 string = '{' + destination_format + '}'
-                                string = string.format(float(self.model.head[slug]['value']))
+                                string = string.format(bounds[slug] if slug in bounds else float(head[slug]['value']))
 
                         else:
                             if slug == 'creation_date':
                                 if self.model.is_subset:
                                     string = ' ' + date.today().strftime('%d/%m/%Y')
                                 else:
-                                    string = ' ' + self.model.head[slug]['value']
+                                    string = ' ' + head[slug]['value']
                             else:
                                 string = '{' + destination_format + '}'
                                 try:
                                     if 'f' in string:
-                                        if slug in self.model.dd_bounds:
-                                            string = string.format(self.model.dd_bounds[slug])
+                                        if slug in bounds:
+                                            string = string.format(bounds[slug])
                                         else:
-                                            string = string.format(float(self.model.head[slug]['value']))
+                                            string = string.format(float(head[slug]['value']))
                                     else:
-                                        string = string.format(int(self.model.head[slug]['value']))
+                                        string = string.format(int(head[slug]['value']))
                                 except:
-                                    string = string.format(self.model.head[slug]['value'])
+                                    string = string.format(head[slug]['value'])
                     else:
                         delimiter = ' : '
-                        string = self.model.head[slug]['value']
+                        string = head[slug]['value']
                     file.write(
-                        fillSpaces(version_structure[slug]['keyword'], delimiter_position) +
+                        fillSpaces(schema.getKeyword(slug, head[slug].get('keyword')), delimiter_position) +
                         delimiter +
                         string +
                         '\n'
@@ -156,102 +186,187 @@ class FileFormat:
                         string = 'deg'
                     else:
                         string = '---'
-                    if item['type'] == 'numeric':
+                    if item.type == 'numeric':
                         delimiter = ' = '
                     else:
                         delimiter = ' : '
                     file.write(
-                        fillSpaces(item['keyword'], delimiter_position) + delimiter + string + '\n'
+                        fillSpaces(item.keyword, delimiter_position) + delimiter + string + '\n'
                     )
             file.write('end_of_head ==================================================\n')
 
-            for list_row in self.model.data:
-                row = listToString(list_row, ':10.4f', 10, True) + '\n'
-                file.write(row)
+            for start, block in self.iterRowBlocks():
+                file.write(blockToString(block, ':10.4f', True))
 
-    def convertToCSV(self):
-        with open(self.saved_file, 'w', newline='') as file:
+    def convertToCSV(self, compress=False, coord_precision=8, value_precision=4, compresslevel=6):
+        if compress:
+            file = gzip.open(self.saved_file, 'wt', compresslevel=compresslevel, newline='')
+        else:
+            file = open(self.saved_file, 'w', newline='')
+        with file:
             file_writer = csv.writer(file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
             file_writer.writerow(['LAT', 'LON', 'N'])
-            row = 0
-            col = 0
-            while row < self.model.getRowsNumber():
-                while col < self.model.getColsNumber():
-                    value = self.model.getValueAtPoint(row, col)
-                    if value > -9000:
-                        coord = self.model.getCoordAtPoint(row, col)
-                        file_writer.writerow([
-                            "{:.8f}".format(coord['lat']),
-                            "{:.8f}".format(coord['lon']),
-                            "{:.4f}".format(value)
-                        ])
-                    col += 1
-                row += 1
-                col = 0
+
+            # Node coordinates are computed once per axis; numeric fields never need quoting
+            coord = self.model.getCoordAtPoint(np.arange(self.model.getRowsNumber()), np.arange(self.model.getColsNumber()))
+            line_template = '{{:.{0}f}},{{:.{0}f}},{{:.{1}f}}'.format(coord_precision, value_precision) + file_writer.dialect.lineterminator
+            for start, block in self.iterRowBlocks():
+                rows, cols = np.nonzero(block > NODATA_THRESHOLD)
+                values = np.column_stack((coord['lat'][start + rows], coord['lon'][cols], block[rows, cols]))
+                file.write((line_template * values.shape[0]).format(*values.ravel().tolist()))
 
     def convertToGSF(self):
+        geometry = self.model.geometry
         with open(self.saved_file, 'w') as f:
-            f.write(str(self.model.dd_bounds['lat_min']) + '\n')
-            lon_min = self.model.dd_bounds['lon_min']
+            f.write(str(geometry.lat_min) + '\n')
+            lon_min = geometry.lon_min
             if lon_min < 0:
                 lon_min = 360 + lon_min
             f.write(str(lon_min) + '\n')
-            f.write(str(self.model.dd_bounds['lat_max']) + '\n')
-            lon_max = self.model.dd_bounds['lon_max']
+            f.write(str(geometry.lat_max) + '\n')
+            lon_max = geometry.lon_max
             if lon_max < 0:
                 lon_max = 360 + lon_max
             f.write(str(lon_max) + '\n')
-            f.write(str(self.model.head['ncols']['value']) + '\n')
-            f.write(str(self.model.head['nrows']['value']) + '\n')
-            row = 0
-            col = 0
-            while row < self.model.getRowsNumber():
-                while col < self.model.getColsNumber():
-                    f.write(str(self.model.getValueAtPoint(row, col)) + '\n')
-                    col += 1
-                row += 1
-                col = 0
-
-    def convertToTIF(self):
-        data = np.matrix(self.model.data)
-        delta_lon = (self.model.dd_bounds['lon_max'] - self.model.dd_bounds['lon_min']) / (data.shape[1] - 1)
-        delta_lat = (self.model.dd_bounds['lat_max'] - self.model.dd_bounds['lat_min']) / (data.shape[0] - 1)
-        Z = np.where(data < -9000, np.nan, data)
-        transform = rasterio.transform.Affine.translation(self.model.dd_bounds['lon_min'] - delta_lon / 2, self.model.dd_bounds['lat_max'] + delta_lat / 2) * rasterio.transform.Affine.scale(delta_lon, -delta_lat)
-        with rasterio.open(
-                self.saved_file,
-                'w',
-                driver='GTiff',
-                height=Z.shape[0],
-                width=Z.shape[1],
-                count=1,
-                dtype=Z.dtype,
-                crs='epsg:4326',
-                transform=transform
-        ) as dst:
-            dst.write(Z, 1)
+            f.write(str(geometry.ncols) + '\n')
+            f.write(str(geometry.nrows) + '\n')
+            for start, block in self.iterRowBlocks():
+                f.write('\n'.join(map(str, block.ravel().tolist())) + '\n')
+
+    def convertToGTX(self):
+        # NOAA GTX: big-endian header, then float32 rows from south to north
+        geometry = self.model.geometry
+        lon_min = geometry.lon_min
+        if lon_min < 0:
+            lon_min = 360 + lon_min
+        with open(self.saved_file, 'wb') as f:
+            f.write(struct.pack('>ddddii', geometry.lat_min, lon_min, geometry.delta_lat, geometry.delta_lon, geometry.nrows, geometry.ncols))
+            data_offset = f.tell()
+            # The blocks come N-to-S: each one is flipped and written where its rows belong
+            for start, block in self.iterRowBlocks():
+                f.seek(data_offset + (geometry.nrows - start - block.shape[0]) * geometry.ncols * 4)
+                f.write(np.where(block < NODATA_THRESHOLD, GTX_NODATA_VALUE, block)[::-1].astype('>f4').tobytes())
+
+    def convertToBIN(self):
+        # Raw little-endian float32 grid (N-to-S, W-to-E) after a newline-terminated JSON header
+        geometry = self.model.geometry
+        header = {
+            'format': 'ISGFormatHandler raw grid',
+            'model_name': self.model.head['model_name']['value'],
+            'nrows': geometry.nrows,
+            'ncols': geometry.ncols,
+            'lat_min': geometry.lat_min,
+            'lat_max': geometry.lat_max,
+            'lon_min': geometry.lon_min,
+            'lon_max': geometry.lon_max,
+            'delta_lat': geometry.delta_lat,
+            'delta_lon': geometry.delta_lon,
+            'data_ordering': 'N-to-S, W-to-E',
+            'dtype': '<f4',
+            'nodata': NODATA_VALUE,
+        }
+        # The header is padded so that the grid starts on a BIN_ALIGNMENT boundary and can be memory-mapped
+        header_bytes = json.dumps(header).encode('utf8')
+        header['data_offset'] = -(-(len(header_bytes) + 32) // BIN_ALIGNMENT) * BIN_ALIGNMENT
+        header_bytes = json.dumps(header).encode('utf8')
+        header_bytes = header_bytes.ljust(header['data_offset'] - 1) + b'\n'
+        with open(self.saved_file, 'wb') as f:
+            f.write(header_bytes)
+            for start, block in self.iterRowBlocks():
+                f.write(np.ascontiguousarray(block, dtype='<f4').tobytes())
+
+    def convertToTIF(self, dtype='float64', nodata=None, tiled=False, blocksize=256, compress=None, predictor=None,
+                     overviews=None, cog=False):
+        # The defaults keep the original output: an untiled float64 strip GeoTIFF with nodata cells set to NaN.
+        # cog=True writes a cloud-optimized GeoTIFF: tiled, compressed, with a nodata tag and overviews
+        import rasterio
+        import rasterio.shutil
+        from rasterio.enums import Resampling
+        from rasterio.io import MemoryFile
+        if cog:
+            tiled = True
+            compress = 'deflate' if compress is None else compress
+            nodata = NODATA_VALUE if nodata is None else nodata
+            overviews = 'auto' if overviews is None else overviews
+        if compress is not None and compress.lower() not in TIF_COMPRESSIONS:
+            raise ValueError('Unsupported TIF compression {!r}, expected one of {}'.format(compress, TIF_COMPRESSIONS))
+        dtype = np.dtype(dtype)
+        if predictor is None and compress is not None:
+            predictor = 3 if dtype.kind == 'f' else 2
+
+        nrows, ncols = self.model.geometry.shape
+        profile = {
+            'driver': 'GTiff',
+            'height': nrows,
+            'width': ncols,
+            'count': 1,
+            'dtype': dtype,
+            'crs': 'epsg:4326',
+            'transform': self.model.geometry.getTransform(),
+        }
+        if nodata is not None:
+            profile['nodata'] = nodata
+        if tiled:
+            profile.update(tiled=True, blockxsize=blocksize, blockysize=blocksize)
+
+        if overviews == 'auto':
+            overviews = overviewFactors((nrows, ncols), blocksize)
+        overviews = list(overviews or [])
+
+        if not cog:
+            if compress is not None:
+                profile.update(compress=compress, predictor=predictor)
+            with rasterio.open(self.saved_file, 'w', **profile) as dst:
+                self.writeTIFBlocks(dst, dtype, nodata)
+                if overviews:
+                    dst.build_overviews(overviews, Resampling.average)
+                    dst.update_tags(ns='rio_overview', resampling='average')
+            return
+
+        # The COG driver only copies from an existing dataset, so the grid and its overviews are staged first: in
+        # memory, or in a compressed file next to the output when the grid is larger than the memory budget
+        staging_path = None
+        if nrows * ncols * dtype.itemsize > self.model.memory_budget:
+            staging_path = self.saved_file + '.staging.tif'
+            profile.update(compress=compress, predictor=predictor)
+        try:
+            with MemoryFile() as memory_file:
+                with (memory_file.open(**profile) if staging_path is None else rasterio.open(staging_path, 'w', **profile)) as staged:
+                    self.writeTIFBlocks(staged, dtype, nodata)
+                    if overviews:
+                        staged.build_overviews(overviews, Resampling.average)
+                with (memory_file.open() if staging_path is None else rasterio.open(staging_path)) as staged:
+                    rasterio.shutil.copy(
+                        staged,
+                        self.saved_file,
+                        driver='COG',
+                        blocksize=blocksize,
+                        compress=compress.upper(),
+                        predictor=COG_PREDICTORS[predictor],
+                        overviews='FORCE_USE_EXISTING' if overviews else 'NONE',
+                        overview_resampling='AVERAGE',
+                    )
+        finally:
+            if staging_path is not None and os.path.exists(staging_path):
+                os.remove(staging_path)
+
+    def writeTIFBlocks(self, dst, dtype, nodata):
+        # Blocks are whole strips or rows of tiles of the output, so compressed blocks are written once
+        from rasterio.windows import Window
+        block_height = dst.block_shapes[0][0]
+        rows_per_block = max(1, self.model.getRowsPerBlock() // block_height) * block_height
+        for start, block in self.iterRowBlocks(rows_per_block):
+            values = np.where(block < NODATA_THRESHOLD, np.nan if nodata is None else nodata, block).astype(dtype, copy=False)
+            dst.write(values, 1, window=Window(0, start, values.shape[1], values.shape[0]))
 
     def convertToGEM(self):
         model_name = self.model.head['model_name']['value']
 
-        lat_min = self.model.dd_bounds['lat_min']
-        lat_max = self.model.dd_bounds['lat_max']
-        lon_min = self.model.dd_bounds['lon_min']
-        lon_max = self.model.dd_bounds['lon_max']
-        delta_lat = self.model.dd_bounds['delta_lat']
-        delta_lon = self.model.dd_bounds['delta_lon']
-
-        values_number, values_number_for_avg = 0, 0
-        values_sum = 0
-        for row in self.model.data:
-            for value in row:
-                values_number += 1
-                if value > -9000:
-                    values_number_for_avg += 1
-                    values_sum += value
-        average = values_sum / values_number_for_avg
-
-        ncols = int(self.model.head['ncols']['value'])
+        lat_min, lat_max, lon_min, lon_max, delta_lat, delta_lon, nrows, ncols = self.model.geometry
+
+        valid_values = self.model.data[~self.model.getNodataMask()]
+        values_number = self.model.data.size
+        average = float(valid_values.mean())
 
         with open(self.saved_file, 'wb') as gem:
             deg_to_radians_coeff = math.pi / 180
@@ -285,17 +400,7 @@ class FileFormat:
 
             nrow = nvals / ncol
 
-            row, col = 0, 0
-            while row < self.model.getRowsNumber():
-                while col < self.model.getColsNumber():
-                    undulation = self.model.getValueAtPoint(row, col)
-                    if undulation > -9000:
-                        val = int((undulation - ave) * 1000)
-
-                        gem.write(struct.pack('h', val))
-                    col += 1
-                row += 1
-                col = 0
+            gem.write(np.trunc((valid_values - ave) * 1000).astype(np.int16).tobytes())
 
             '''
             for i in range(0, int(nrow * ncol)):
@@ -305,16 +410,16 @@ class FileFormat:
             '''
 
     def convertToGRI(self):
+        geometry = self.model.geometry
         with open(self.saved_file, 'w') as f:
             number_format = ':10.4f'
-            first_row = str(('{' + number_format + '}').format(self.model.dd_bounds['lat_min'])) + "\t\t"
-            first_row += str(('{' + number_format + '}').format(self.model.dd_bounds['lat_max'])) + "\t\t"
-            first_row += str(('{' + number_format + '}').format(self.model.dd_bounds['lon_min'])) + "\t\t"
-            first_row += str(('{' + number_format + '}').format(self.model.dd_bounds['lon_max'])) + "\t\t"
-            first_row += str(('{' + number_format + '}').format(self.model.dd_bounds['delta_lat'])) + "\t\t"
-            first_row += str(('{' + number_format + '}').format(self.model.dd_bounds['delta_lon']))
+            first_row = str(('{' + number_format + '}').format(geometry.lat_min)) + "\t\t"
+            first_row += str(('{' + number_format + '}').format(geometry.lat_max)) + "\t\t"
+            first_row += str(('{' + number_format + '}').format(geometry.lon_min)) + "\t\t"
+            first_row += str(('{' + number_format + '}').format(geometry.lon_max)) + "\t\t"
+            first_row += str(('{' + number_format + '}').format(geometry.delta_lat)) + "\t\t"
+            first_row += str(('{' + number_format + '}').format(geometry.delta_lon))
             f.write(first_row + '\n')
 
-            for list_row in self.model.data:
-                row = listToString(list_row, number_format, 10) + '\n'
-                f.write(row)
+            for start, block in self.iterRowBlocks():
+                f.write(blockToString(block, number_format))
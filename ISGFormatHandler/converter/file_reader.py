@@ -0,0 +1,143 @@
+import json
+import os
+import struct
+from datetime import date
+import numpy as np
+
+from ..model.config import NODATA_THRESHOLD, NODATA_VALUE
+from ..model.grid_geometry import GridGeometry
+from ..model.isg_parser import NEWLINE, CARRIAGE_RETURN, decode_line, parse_data_buffer
+from .file_format import GTX_NODATA_VALUE
+
+GRI_CELL_WIDTH = 10
+GTX_HEADER = struct.Struct('>ddddii')
+
+
+def gridGeometry(lat_max, lon_min, delta_lat, delta_lon, nrows, ncols):
+    return GridGeometry(
+        lat_max - delta_lat * (nrows - 1), lat_max, lon_min, lon_min + delta_lon * (ncols - 1),
+        delta_lat, delta_lon, int(nrows), int(ncols)
+    )
+
+
+class FileReader:
+
+    def __init__(self, model, source_file):
+        self.model = model
+        self.source_file = source_file
+
+    def setGrid(self, data, geometry, epsg_code='---', model_name=None):
+        # The grid becomes an ISG 2.0 model (node bounds, N-to-S, W-to-E) and is standardized like a read file
+        values = geometry.getBounds()
+        values.update({
+            'model_name': model_name or os.path.splitext(os.path.basename(self.source_file))[0],
+            'data_format': 'grid',
+            'data_ordering': 'N-to-S, W-to-E',
+            'coord_type': 'geodetic',
+            'coord_units': 'deg',
+            'epsg_code': epsg_code,
+            'nrows': geometry.nrows,
+            'ncols': geometry.ncols,
+            'nodata': NODATA_VALUE,
+            'creation_date': date.today().strftime('%d/%m/%Y'),
+            'isg_format': '2.0',
+        })
+        head = self.model.getStructureByVersion('2.0')
+        for slug, item in head.items():
+            item['value'] = str(values.get(slug, '---'))
+
+        self.model.file_path = self.source_file
+        self.model.isg_model_format = '2.0'
+        self.model.comment_section = []
+        self.model.head = head
+        self.model.dd_bounds = {}
+        self.model.is_dms_format = False
+        self.model.data = data
+        self.model.standardizeModel()
+        # The spacing stays the one of the source instead of being recomputed from the printed bounds
+        self.model.setGeometry(geometry)
+
+    def readTIF(self, bounds=None, band=1):
+        import rasterio
+        from rasterio.windows import Window
+        with rasterio.open(self.source_file) as src:
+            transform = src.transform
+            if transform.b or transform.d or transform.e >= 0:
+                raise ValueError('Only north-up GeoTIFF grids without rotation can be read')
+            if src.crs is not None and not src.crs.is_geographic:
+                raise ValueError('GeoTIFF grid must use geographic coordinates, found {}'.format(src.crs))
+            # Grid nodes sit at the pixel centres
+            geometry = gridGeometry(
+                transform.f + transform.e / 2, transform.c + transform.a / 2, -transform.e, transform.a, src.height, src.width
+            )
+
+            # Only the blocks covering the requested bounds are decoded
+            row_start, row_stop, col_start, col_stop = 0, src.height, 0, src.width
+            if bounds is not None:
+                index_window = geometry.getIndexWindow(bounds)
+                if index_window is None:
+                    raise ValueError('Bounds {} do not overlap the grid'.format(bounds))
+                row_start, row_stop, col_start, col_stop = index_window
+            window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+            data = src.read(band, window=window, masked=True)
+            epsg_code = src.crs.to_epsg() if src.crs is not None else None
+
+        nodata = np.ma.getmaskarray(data) | np.isnan(data.data) | (data.data < NODATA_THRESHOLD)
+        data = np.where(nodata, NODATA_VALUE, data.data).astype(self.model.dtype)
+        self.setGrid(data, geometry.getWindow(row_start, row_stop, col_start, col_stop), epsg_code or '---')
+
+    def readGRI(self):
+        with open(self.source_file, 'rb') as f:
+            lat_min, lat_max, lon_min, lon_max, delta_lat, delta_lon = [float(i) for i in decode_line(f.readline()).split()]
+            buffer = f.read()
+        nrows = int(round((lat_max - lat_min) / delta_lat)) + 1
+        ncols = int(round((lon_max - lon_min) / delta_lon)) + 1
+
+        # The header carries 4 decimals only, so on fine grids the shape comes from the one-row-per-line layout
+        # written by convertToGRI; rows wrapped over several lines (GRAVSOFT) keep the shape derived from the header
+        raw = np.frombuffer(buffer, dtype=np.uint8)
+        line_ends = np.flatnonzero(raw == NEWLINE)
+        if line_ends.size:
+            width = int(line_ends[0]) - int(line_ends[0] > 0 and raw[line_ends[0] - 1] == CARRIAGE_RETURN)
+            line_count = line_ends.size + (raw[-1] != NEWLINE)
+            if width % GRI_CELL_WIDTH == 0 and 0.5 < width // GRI_CELL_WIDTH / ncols < 2:
+                nrows, ncols = int(line_count), width // GRI_CELL_WIDTH
+
+        data = parse_data_buffer(buffer, nrows, ncols, self.model.dtype, touching_cells=True)
+        self.setGrid(data, GridGeometry.fromBounds(lat_min, lat_max, lon_min, lon_max, delta_lat, delta_lon, nrows, ncols))
+
+    def readGSF(self):
+        with open(self.source_file, 'rb') as f:
+            lat_min, lon_min, lat_max, lon_max = [float(decode_line(f.readline())) for i in range(4)]
+            ncols, nrows = [int(decode_line(f.readline())) for i in range(2)]
+            buffer = f.read()
+        # The header gives the outer nodes only, so a single row or column leaves its spacing unknown
+        if nrows < 2 or ncols < 2:
+            raise ValueError('GSF grid of {} x {} nodes has no spacing: at least 2 rows and 2 columns are needed'.format(nrows, ncols))
+        # Longitudes are stored in 0..360 and are moved back together, so that a 0..360 grid stays one. A grid
+        # crossing the prime meridian, or spanning a full turn, starts a turn earlier, keeping lon_max >= lon_min
+        if lon_min > 180 and lon_max > 180:
+            lon_min -= 360
+            lon_max -= 360
+        if lon_max < lon_min or (lon_max == lon_min and ncols > 1):
+            lon_min -= 360
+        data = parse_data_buffer(buffer, nrows, ncols, self.model.dtype)
+        self.setGrid(data, GridGeometry.fromBounds(lat_min, lat_max, lon_min, lon_max, 0.0, 0.0, nrows, ncols))
+
+    def readGTX(self):
+        with open(self.source_file, 'rb') as f:
+            lat_min, lon_min, delta_lat, delta_lon, nrows, ncols = GTX_HEADER.unpack(f.read(GTX_HEADER.size))
+            data = np.fromfile(f, dtype='>f4', count=nrows * ncols).reshape(nrows, ncols)[::-1]
+        if lon_min > 180:
+            lon_min -= 360
+        data = np.where((data == np.float32(GTX_NODATA_VALUE)) | np.isnan(data), NODATA_VALUE, data).astype(self.model.dtype)
+        self.setGrid(data, gridGeometry(lat_min + delta_lat * (nrows - 1), lon_min, delta_lat, delta_lon, nrows, ncols))
+
+    def readBIN(self):
+        with open(self.source_file, 'rb') as f:
+            header = json.loads(decode_line(f.readline()))
+            f.seek(header['data_offset'])
+            data = np.fromfile(f, dtype=header['dtype'], count=header['nrows'] * header['ncols'])
+        data = data.reshape(header['nrows'], header['ncols']).astype(self.model.dtype)
+        geometry = GridGeometry(*[header[slug] for slug in GridGeometry._fields])
+        self.setGrid(data, geometry, model_name=header.get('model_name'))
@@ -0,0 +1,121 @@
+import numpy as np
+
+from .config import NODATA_VALUE
+from .sampling import axis_stencil, resample_stencils
+
+# About the peak memory per cell of a row block decoded from text, transformed and written out (CSV takes the most)
+BLOCK_BYTES_PER_CELL = 192
+
+
+def block_rows(ncols, memory_budget) -> int:
+    return max(1, int(memory_budget) // (BLOCK_BYTES_PER_CELL * max(ncols, 1)))
+
+
+class GridStage:
+    # A grid computed band by band from a source grid (a LazyGrid or another stage), with the row interface of
+    # LazyGrid. The operations of a lazy Model chain stages instead of decoding the grid, so the converters pull
+    # their row blocks straight from the file. Large requests are split in bands of chunk_rows rows, which keeps
+    # the source rows decoded at once within the memory budget
+
+    def __init__(self, source, nrows, ncols, chunk_rows):
+        self.source = source
+        self.nrows = nrows
+        self.ncols = ncols
+        self.dtype = source.dtype
+        self.chunk_rows = max(1, chunk_rows)
+
+    def close(self):
+        # The source can be shared with other stages and models: it is released once none of them refers to it
+        pass
+
+    def getRows(self, start, stop):
+        start, stop = max(start, 0), min(stop, self.nrows)
+        if start >= stop:
+            return np.empty((0, self.ncols), dtype=self.dtype)
+        if stop - start <= self.chunk_rows:
+            return self.computeRows(start, stop)
+        rows = np.empty((stop - start, self.ncols), dtype=self.dtype)
+        for band_start in range(start, stop, self.chunk_rows):
+            band_stop = min(band_start + self.chunk_rows, stop)
+            rows[band_start - start:band_stop - start] = self.computeRows(band_start, band_stop)
+        return rows
+
+    def computeRows(self, start, stop):
+        raise NotImplementedError
+
+    def getRow(self, row):
+        if row < 0:
+            row += self.nrows
+        return self.getRows(row, row + 1)[0]
+
+    def getValue(self, row, col):
+        return self.getRow(row)[col]
+
+    def read(self):
+        return self.getRows(0, self.nrows)
+
+
+class WindowGrid(GridStage):
+    # Rows row_start:row_stop and columns col_start:col_stop of the source
+
+    def __init__(self, source, row_start, row_stop, col_start, col_stop, memory_budget):
+        super().__init__(source, row_stop - row_start, col_stop - col_start, block_rows(source.ncols, memory_budget))
+        self.row_start = row_start
+        self.col_start = col_start
+
+    def computeRows(self, start, stop):
+        rows = self.source.getRows(self.row_start + start, self.row_start + stop)
+        return rows[:, self.col_start:self.col_start + self.ncols]
+
+
+class PaddedGrid(GridStage):
+    # The source surrounded by rows and columns of nodata
+
+    def __init__(self, source, top, bottom, left, right, memory_budget):
+        ncols = left + source.ncols + right
+        super().__init__(source, top + source.nrows + bottom, ncols, block_rows(ncols, memory_budget))
+        self.top = top
+        self.left = left
+
+    def computeRows(self, start, stop):
+        rows = np.full((stop - start, self.ncols), NODATA_VALUE, dtype=self.dtype)
+        source_rows = self.source.getRows(start - self.top, stop - self.top)
+        first = max(self.top - start, 0)
+        rows[first:first + source_rows.shape[0], self.left:self.left + self.source.ncols] = source_rows
+        return rows
+
+
+class MaskedGrid(GridStage):
+    # The source with nodata wherever the boolean mask (one value per node) is False
+
+    def __init__(self, source, mask, memory_budget):
+        super().__init__(source, source.nrows, source.ncols, block_rows(source.ncols, memory_budget))
+        self.mask = mask
+
+    def computeRows(self, start, stop):
+        return np.where(self.mask[start:stop], self.source.getRows(start, stop), NODATA_VALUE).astype(self.dtype, copy=False)
+
+
+class ResampledGrid(GridStage):
+    # The source sampled on the tensor-product grid of the 1-D fractional source indices rows and cols. A band of
+    # target rows decodes only the source rows its stencils use, so a coarse target does not read every source row
+    # in between; a target row needs up to four source rows
+
+    def __init__(self, source, rows, cols, method, memory_budget):
+        super().__init__(source, rows.size, cols.size, block_rows(4 * max(source.ncols, cols.size), memory_budget))
+        self.rows = rows
+        self.col_stencil = axis_stencil(cols, source.ncols)
+        self.method = method
+
+    def computeRows(self, start, stop):
+        row_indices, row_fraction, row_inside = axis_stencil(self.rows[start:stop], self.source.nrows)
+        if self.method == 'nearest':
+            # Rounded on the source row numbers as in resample_grid: ties go to the even row, not the even band row
+            row_indices = [np.rint(row_indices[1] + row_fraction).astype(np.intp)] * 4
+            row_fraction = np.zeros_like(row_fraction)
+        used = np.unique(np.concatenate(row_indices))
+        runs = np.split(used, np.flatnonzero(np.diff(used) > 1) + 1)
+        band = np.concatenate([self.source.getRows(int(run[0]), int(run[-1]) + 1) for run in runs])
+        band_indices = [np.searchsorted(used, indices) for indices in row_indices]
+        values = resample_stencils(band, (band_indices, row_fraction, row_inside), self.col_stencil, self.method)
+        return values.astype(self.dtype, copy=False)
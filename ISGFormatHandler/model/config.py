@@ -1,3 +1,6 @@
+NODATA_VALUE = -9999.0
+NODATA_THRESHOLD = -9000.0
+
 ISG_FORMATS = {
     'head': [
         {
@@ -0,0 +1,86 @@
+import math
+from collections import namedtuple
+import numpy as np
+
+BOUND_SLUGS = ['lat_min', 'lat_max', 'lon_min', 'lon_max', 'delta_lat', 'delta_lon']
+INDEX_TOLERANCE = 1e-9
+
+
+class GridGeometry(namedtuple('GridGeometry', BOUND_SLUGS + ['nrows', 'ncols'])):
+    # Node-registered grid: bounds are the outer node coordinates, rows run N-to-S and columns W-to-E.
+    # The spacing is computed once when the geometry is built and carried unchanged into windows and padding
+    __slots__ = ()
+
+    @classmethod
+    def fromBounds(cls, lat_min, lat_max, lon_min, lon_max, delta_lat, delta_lon, nrows, ncols, registration='node'):
+        # 'cell' bounds (ISG 1.x headers) are the outer cell edges, half a cell beyond the outer nodes
+        if registration == 'cell':
+            lat_min, lat_max = lat_min + delta_lat / 2, lat_max - delta_lat / 2
+            lon_min, lon_max = lon_min + delta_lon / 2, lon_max - delta_lon / 2
+        if nrows > 1:
+            delta_lat = (lat_max - lat_min) / (nrows - 1)
+        if ncols > 1:
+            delta_lon = (lon_max - lon_min) / (ncols - 1)
+        return cls(lat_min, lat_max, lon_min, lon_max, delta_lat, delta_lon, int(nrows), int(ncols))
+
+    @property
+    def shape(self):
+        return self.nrows, self.ncols
+
+    def getBounds(self, registration='node') -> dict:
+        bounds = dict(zip(BOUND_SLUGS, self[:6]))
+        if registration == 'cell':
+            bounds['lat_min'] -= self.delta_lat / 2
+            bounds['lat_max'] += self.delta_lat / 2
+            bounds['lon_min'] -= self.delta_lon / 2
+            bounds['lon_max'] += self.delta_lon / 2
+        return bounds
+
+    def rowcol_to_latlon(self, rows, cols):
+        # Accepts scalars or arrays of (fractional) row and column indices
+        lats = self.lat_min + self.delta_lat * (self.nrows - 1 - np.asarray(rows))
+        lons = self.lon_max - self.delta_lon * (self.ncols - 1 - np.asarray(cols))
+        return lats, lons
+
+    def latlon_to_rowcol(self, lats, lons):
+        rows = (self.lat_max - np.asarray(lats)) / self.delta_lat
+        cols = (np.asarray(lons) - self.lon_min) / self.delta_lon
+        return rows, cols
+
+    def getIndexWindow(self, bounds):
+        # Rows and columns of the nodes inside bounds as (row_start, row_stop, col_start, col_stop), None when empty
+        row_start, col_start = self.latlon_to_rowcol(bounds['lat_max'], bounds['lon_min'])
+        row_stop, col_stop = self.latlon_to_rowcol(bounds['lat_min'], bounds['lon_max'])
+        row_start = max(math.ceil(row_start - INDEX_TOLERANCE), 0)
+        row_stop = min(math.floor(row_stop + INDEX_TOLERANCE) + 1, self.nrows)
+        col_start = max(math.ceil(col_start - INDEX_TOLERANCE), 0)
+        col_stop = min(math.floor(col_stop + INDEX_TOLERANCE) + 1, self.ncols)
+        if row_start >= row_stop or col_start >= col_stop:
+            return None
+        return row_start, row_stop, col_start, col_stop
+
+    def getWindow(self, row_start, row_stop, col_start, col_stop):
+        lat_max, lon_min = self.rowcol_to_latlon(row_start, col_start)
+        lat_min, lon_max = self.rowcol_to_latlon(row_stop - 1, col_stop - 1)
+        return self._replace(
+            lat_min=float(lat_min), lat_max=float(lat_max), lon_min=float(lon_min), lon_max=float(lon_max),
+            nrows=int(row_stop - row_start), ncols=int(col_stop - col_start)
+        )
+
+    def getPadded(self, top, bottom, left, right):
+        return self._replace(
+            lat_min=self.lat_min - bottom * self.delta_lat,
+            lat_max=self.lat_max + top * self.delta_lat,
+            lon_min=self.lon_min - left * self.delta_lon,
+            lon_max=self.lon_max + right * self.delta_lon,
+            nrows=self.nrows + top + bottom,
+            ncols=self.ncols + left + right
+        )
+
+    def getTransform(self):
+        # Pixel-is-area transform whose pixel centres are the grid nodes
+        from rasterio.transform import Affine
+        return Affine.translation(
+            self.lon_min - self.delta_lon / 2,
+            self.lat_max + self.delta_lat / 2
+        ) * Affine.scale(self.delta_lon, -self.delta_lat)
@@ -0,0 +1,50 @@
+from collections import namedtuple
+from types import MappingProxyType
+
+from .config import ISG_FORMATS
+
+# keyword is the one written on export, aliases every keyword accepted when reading (keyword first)
+HeadField = namedtuple('HeadField', ['slug', 'keyword', 'aliases', 'type', 'format'])
+
+
+class HeadSchema(namedtuple('HeadSchema', ['version', 'fields', 'keyword_slugs', 'keyword_width'])):
+    # Header layout of one ISG version: fields in output order by slug, the slug of every keyword and alias, and the
+    # width of the keyword column. Schemas are built once at import and shared, so they are read-only
+    __slots__ = ()
+
+    @classmethod
+    def fromConfig(cls, version, head_config):
+        fields = {}
+        for field in head_config:
+            for value in field['values']:
+                if version in value['version']:
+                    keywords = value['keyword'] if isinstance(value['keyword'], list) else [value['keyword']]
+                    fields[field['slug']] = HeadField(field['slug'], keywords[0], tuple(keywords), value['type'], value['format'])
+
+        keyword_slugs = {}
+        for field in fields.values():
+            for keyword in field.aliases:
+                if keyword_slugs.setdefault(keyword, field.slug) != field.slug:
+                    raise ValueError('ISG {} keyword {!r} is used by {} and {}'.format(version, keyword, keyword_slugs[keyword], field.slug))
+        keyword_width = max(len(keyword) for keyword in keyword_slugs)
+        return cls(version, MappingProxyType(fields), MappingProxyType(keyword_slugs), keyword_width)
+
+    def newHead(self) -> dict:
+        # A fresh header to fill, one item per field in output order
+        return {
+            slug: {'keyword': field.keyword, 'type': field.type, 'format': field.format}
+            for slug, field in self.fields.items()
+        }
+
+    def getKeyword(self, slug, keyword=None) -> str:
+        # Keeps the keyword a header was read with when this version accepts it, e.g. 'north min' for 'lat min'
+        field = self.fields[slug]
+        return keyword if keyword in field.aliases else field.keyword
+
+
+def compile_head_schemas(head_config):
+    versions = sorted({version for field in head_config for value in field['values'] for version in value['version']})
+    return MappingProxyType({version: HeadSchema.fromConfig(version, head_config) for version in versions})
+
+
+HEAD_SCHEMAS = compile_head_schemas(ISG_FORMATS['head'])
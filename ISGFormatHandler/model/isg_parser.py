@@ -0,0 +1,132 @@
+import warnings
+import numpy as np
+
+HEAD_END_MARKER = b'end_of_head'
+
+SPACE, TAB, NEWLINE, CARRIAGE_RETURN = 32, 9, 10, 13
+DIGIT_0, DOT, MINUS, PLUS = 48, 46, 45, 43
+
+# Mantissas up to 15 digits are exact in float64, so mantissa / 10**k is correctly rounded like float()
+MAX_MANTISSA_DIGITS = 15
+POWERS_OF_TEN = 10.0 ** np.arange(MAX_MANTISSA_DIGITS + 1)
+CHUNK_CELLS = 1 << 20
+
+
+def decode_line(line):
+    return line.decode('utf8').replace('\r\n', '\n')
+
+
+def read_head_section(f):
+    # Reads comment and header lines, leaving f positioned at the first data byte
+    lines = []
+    for line in f:
+        lines.append(decode_line(line))
+        if HEAD_END_MARKER in line:
+            return lines
+    raise ValueError('ISG file has no end_of_head marker')
+
+
+def decode_fixed_width_cells(lines, ncols, touching_cells=False):
+    # lines: uint8 matrix with one grid row per line and no line terminators;
+    # touching_cells allows cells without a separating space (GRI writes '%10.4f' back to back)
+    nrows, width = lines.shape
+    if width % ncols:
+        return None
+    # Column-major copy so that every pass below runs over contiguous memory
+    columns = np.ascontiguousarray(lines.reshape(nrows * ncols, width // ncols).T)
+    size = columns.shape[1]
+
+    # Tokens must not touch across cell borders
+    if not touching_cells and np.any((columns[-1] != SPACE).reshape(nrows, ncols)[:, :-1] & (columns[0] != SPACE).reshape(nrows, ncols)[:, 1:]):
+        return None
+
+    mantissa = np.zeros(size, dtype=np.int64)
+    digits = np.zeros(size, dtype=np.uint8)
+    fraction_digits = np.zeros(size, dtype=np.uint8)
+    dots = np.zeros(size, dtype=np.uint8)
+    token_starts = np.zeros(size, dtype=np.uint8)
+    negative = np.zeros(size, dtype=bool)
+    previous_space = np.ones(size, dtype=bool)
+    for column in columns:
+        digit = column - DIGIT_0
+        is_digit = digit < 10
+        is_space = column == SPACE
+        is_dot = column == DOT
+        is_minus = column == MINUS
+        is_sign = is_minus | (column == PLUS)
+        if not np.all(is_space | is_digit | is_dot | is_sign):
+            return None
+        # A sign is only valid as the first character of a token
+        if np.any(is_sign & ~previous_space):
+            return None
+        token_starts += ~is_space & previous_space
+        negative |= is_minus
+        mantissa *= np.where(is_digit, 10, 1)
+        mantissa += np.where(is_digit, digit, 0)
+        digits += is_digit
+        fraction_digits += is_digit & (dots > 0)
+        dots += is_dot
+        previous_space = is_space
+
+    if np.any(token_starts != 1) or np.any(dots > 1):
+        return None
+    if np.any(digits == 0) or np.any(digits > MAX_MANTISSA_DIGITS):
+        return None
+
+    values = mantissa / POWERS_OF_TEN[fraction_digits]
+    return np.where(negative, -values, values)
+
+
+def decode_fixed_width(raw, out, touching_cells=False):
+    nrows, ncols = out.shape
+    line_length = int(np.argmax(raw == NEWLINE)) + 1
+    data_length = nrows * line_length
+    if raw.size < data_length or raw[line_length - 1] != NEWLINE:
+        return False
+    if not np.all(raw[line_length - 1:data_length:line_length] == NEWLINE):
+        return False
+    trailer = raw[data_length:]
+    if not np.all((trailer == SPACE) | (trailer == TAB) | (trailer == NEWLINE) | (trailer == CARRIAGE_RETURN)):
+        return False
+
+    content_width = line_length - 1
+    if content_width and np.all(raw[line_length - 2:data_length:line_length] == CARRIAGE_RETURN):
+        content_width -= 1
+    lines = raw[:data_length].reshape(nrows, line_length)[:, :content_width]
+
+    rows_per_chunk = max(1, CHUNK_CELLS // ncols)
+    for start in range(0, nrows, rows_per_chunk):
+        values = decode_fixed_width_cells(lines[start:start + rows_per_chunk], ncols, touching_cells)
+        if values is None:
+            return False
+        out[start:start + rows_per_chunk] = values.reshape(-1, ncols)
+    return True
+
+
+def parse_data_buffer(buffer, nrows, ncols, dtype=np.float64, touching_cells=False):
+    out = np.empty((nrows, ncols), dtype=dtype)
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    if nrows and ncols and raw.size and decode_fixed_width(raw, out, touching_cells):
+        return out
+
+    # Irregular layouts (wrapped rows, exponents, ragged spacing) go through numpy's text parser
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            values = np.fromstring(buffer, dtype=dtype, sep=' ')
+    except ValueError:
+        raise ValueError('ISG data section contains non-numeric values')
+    if values.size != nrows * ncols:
+        raise ValueError(
+            'ISG data section holds {} values, header declares nrows x ncols = {} x {}'.format(values.size, nrows, ncols)
+        )
+    out[...] = values.reshape(nrows, ncols)
+    return out
+
+
+def parse_data_section(f, nrows, ncols, dtype=np.float64):
+    return parse_data_buffer(f.read(), nrows, ncols, dtype)
+
+
+def parse_data_lines(lines, nrows, ncols, dtype=np.float64):
+    return parse_data_buffer(''.join(lines).encode('utf8'), nrows, ncols, dtype)
@@ -0,0 +1,111 @@
+import mmap
+from collections import OrderedDict
+import numpy as np
+
+from .isg_parser import NEWLINE, CARRIAGE_RETURN, parse_data_buffer
+
+
+class LazyGrid:
+    row_cache_size = 64
+    index_chunk_size = 1 << 24
+
+    def __init__(self, path, data_offset, nrows, ncols, data_ordering='N-to-S, W-to-E', dtype=np.float64):
+        self.path = path
+        self.data_offset = data_offset
+        self.nrows = nrows
+        self.ncols = ncols
+        self.flip_rows = data_ordering.startswith('S-to-N')
+        self.flip_cols = data_ordering.endswith('E-to-W')
+        self.dtype = np.dtype(dtype)
+        self.row_offsets = None
+        self.full_grid = None
+        self.row_cache = OrderedDict()
+        self.open()
+
+    def open(self):
+        with open(self.path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __getstate__(self):
+        # Pickled (e.g. for a process pool) without the map: the copy maps the file again, keeping the row index
+        state = self.__dict__.copy()
+        state['buffer'] = None
+        state['row_cache'] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open()
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+
+    def buildRowIndex(self):
+        # Newlines are searched chunk by chunk, so indexing a file larger than memory holds only the line ends
+        raw = np.frombuffer(self.buffer, dtype=np.uint8, offset=self.data_offset)
+        line_ends = np.concatenate([np.empty(0, dtype=np.intp)] + [
+            np.flatnonzero(raw[start:start + self.index_chunk_size] == NEWLINE) + start
+            for start in range(0, raw.size, self.index_chunk_size)
+        ])
+        if raw.size and raw[-1] != NEWLINE:
+            line_ends = np.append(line_ends, raw.size)
+        line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+
+        # Blank lines are skipped; rows wrapped over several lines cannot be addressed by line
+        content_ends = line_ends - (raw[np.maximum(line_ends - 1, 0)] == CARRIAGE_RETURN)
+        non_blank = content_ends > line_starts
+        if np.count_nonzero(non_blank) != self.nrows:
+            self.full_grid = parse_data_buffer(self.buffer[self.data_offset:], self.nrows, self.ncols, self.dtype)
+            return
+        self.row_offsets = np.column_stack((line_starts[non_blank], line_ends[non_blank])) + self.data_offset
+
+    def readFileRows(self, start, stop):
+        if self.row_offsets is None and self.full_grid is None:
+            self.buildRowIndex()
+        if self.full_grid is not None:
+            return self.full_grid[start:stop]
+        # The slice keeps the newline of the last row, which the fixed-width decoder needs to read the rows in bulk
+        begin = self.row_offsets[start][0]
+        end = self.row_offsets[stop - 1][1] + 1
+        return parse_data_buffer(self.buffer[begin:end], stop - start, self.ncols, self.dtype)
+
+    def getRows(self, start, stop):
+        # Rows are addressed in the standardized N-to-S, W-to-E orientation
+        start, stop = max(start, 0), min(stop, self.nrows)
+        if start >= stop:
+            return np.empty((0, self.ncols), dtype=self.dtype)
+        if self.flip_rows:
+            rows = self.readFileRows(self.nrows - stop, self.nrows - start)[::-1]
+        else:
+            rows = self.readFileRows(start, stop)
+        if self.flip_cols:
+            rows = rows[:, ::-1]
+        return np.ascontiguousarray(rows)
+
+    def getRow(self, row):
+        if row < 0:
+            row += self.nrows
+        if row in self.row_cache:
+            self.row_cache.move_to_end(row)
+            return self.row_cache[row]
+        values = self.getRows(row, row + 1)[0]
+        self.row_cache[row] = values
+        if len(self.row_cache) > self.row_cache_size:
+            self.row_cache.popitem(last=False)
+        return values
+
+    def getValue(self, row, col):
+        return self.getRow(row)[col]
+
+    def read(self):
+        if self.full_grid is not None:
+            grid = self.full_grid
+        else:
+            grid = parse_data_buffer(self.buffer[self.data_offset:], self.nrows, self.ncols, self.dtype)
+        if self.flip_rows:
+            grid = grid[::-1]
+        if self.flip_cols:
+            grid = grid[:, ::-1]
+        return np.ascontiguousarray(grid)
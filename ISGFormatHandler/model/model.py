@@ -1,38 +1,151 @@
+import copy
 import math
+import os
+import queue
 import tempfile
-import geopandas
-import matplotlib.pyplot as plt
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from scipy import interpolate
-from mpl_toolkits.basemap import Basemap
-from shapely.geometry import Point, Polygon
 
-from .config import ISG_FORMATS
+from .block_grid import MaskedGrid, PaddedGrid, ResampledGrid, WindowGrid, block_rows
+from .config import NODATA_THRESHOLD, NODATA_VALUE
+from .grid_geometry import BOUND_SLUGS, GridGeometry
+from .head_schema import HEAD_SCHEMAS
+from .isg_parser import parse_data_lines, parse_data_section, read_head_section
+from .lazy_grid import LazyGrid
+from .model_cache import load_cache, save_cache
+from .sampling import SAMPLE_METHODS, inside_grid, resample_grid, sample_grid
 from .values_conversion import dms_to_deg
 from ..converter.file_format import FileFormat
+from ..converter.file_reader import FileReader
 from ..shapefile.shapefile import Shapefile
 
+# geopandas, matplotlib, Basemap and rasterio are imported by the methods that need them, so reading a grid
+# and sampling it does not pay for their import
+
+# Row blocks a convertToMany converter may fall behind the others
+BLOCK_QUEUE_SIZE = 2
+# Formats whose writers format text in Python
+TEXT_FORMATS = ('isg1.01', 'isg2.00', 'csv', 'csv.gz', 'gsf', 'gri')
+# The model of a convertToMany worker process, set once by the pool initializer
+worker_model = None
+
+
+def set_worker_model(model):
+    global worker_model
+    worker_model = model
+
+
+def convert_in_worker(path, extension):
+    return worker_model.convertTo(path, extension)
+
+
+def convert_from_queue(model, path, extension, block_queue):
+    blocks = iter(block_queue.get, None)
+    try:
+        return model.convertTo(path, extension, blocks)
+    finally:
+        # A converter that stopped early still empties its queue, so the grid keeps flowing to the others
+        for item in blocks:
+            pass
+
 
 class Model:
-    head_config_fields = ISG_FORMATS['head']
+    sample_chunk_size = 1 << 20
+    # About the memory a row block may take while it is streamed from a lazy grid to a converter
+    memory_budget = 1 << 28
 
-    def __init__(self):
+    def __init__(self, dtype=np.float64):
         self.file_path = None
         self.isg_model_format = None
         self.comment_section = []
         self.head = {}
-        self.data = []
+        self.dtype = np.dtype(dtype)
+        self.lazy_grid = None
+        self.data = np.empty((0, 0), dtype=self.dtype)
         self.dd_bounds = {}
+        self.geometry = None
         self.is_subset = False
         self.is_dms_format = False
 
-    def retrieveByPath(self, path) -> None:
+    @property
+    def data(self):
+        # A lazily opened model decodes the whole grid the first time it is needed as an array
+        if self._data is None:
+            self.data = self.lazy_grid.read()
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        # Every assignment drops the cached nodata mask and any lazy grid. The lazy grid is not closed, since windows
+        # and other models derived from this one may still read from it
+        self._data = np.asarray(value, dtype=self.dtype)
+        self._nodata_mask = None
+        self.lazy_grid = None
+
+    def setLazyGrid(self, lazy_grid) -> None:
+        # The grid is decoded from lazy_grid one row block at a time; reading model.data decodes it whole
+        self._data = None
+        self._nodata_mask = None
+        self.lazy_grid = lazy_grid
+
+    def isLazy(self):
+        return self._data is None
+
+    def getNodataMask(self):
+        if self._nodata_mask is None:
+            self._nodata_mask = self.data < NODATA_THRESHOLD
+        return self._nodata_mask
+
+    def retrieveByPath(self, path, lazy=False, cache=False, cache_dir=None) -> None:
+        # The cache holds the standardized model next to the source file or in cache_dir
+        if cache and load_cache(self, path, cache_dir):
+            return
         self.file_path = path
-        with open(self.file_path, encoding='utf8') as f:
-            lines = f.readlines()
-        self.read(lines)
+        with open(self.file_path, 'rb') as f:
+            self.read(read_head_section(f), parse_data=False)
+            if lazy:
+                data_ordering = self.head['data_ordering']['value'] if self.isg_model_format == '2.0' else 'N-to-S, W-to-E'
+                self.setLazyGrid(LazyGrid(path, f.tell(), self.getRowsNumber(), self.getColsNumber(), data_ordering, self.dtype))
+            else:
+                self.data = parse_data_section(f, self.getRowsNumber(), self.getColsNumber(), self.dtype)
         self.standardizeModel()
+        if cache and not self.isLazy():
+            try:
+                save_cache(self, path, cache_dir)
+            except OSError:
+                pass
+
+    def readHeader(self, path) -> dict:
+        # Reads the comment and header lines only, stopping at end_of_head: the grid is never read and data stays empty
+        self.file_path = path
+        with open(path, 'rb') as f:
+            lines = read_head_section(f)
+        if not any('ISG format' in line for line in lines):
+            raise ValueError('{} has no ISG format line'.format(path))
+        self.read(lines, parse_data=False)
+        self.standardizeModel()
+        return self.getMetadata()
+
+    def importFrom(self, path, extension=None, **options) -> None:
+        # Reads the grid formats convertTo writes; keyword options go to the reader, e.g. bounds to read a TIF window
+        if extension is None:
+            extension = os.path.splitext(path)[1][1:]
+        reader = FileReader(self, path)
+        if extension.lower() == 'isg':
+            self.retrieveByPath(path, **options)
+        elif extension.lower() in ['tif', 'tiff']:
+            reader.readTIF(**options)
+        elif extension.lower() == 'gri':
+            reader.readGRI(**options)
+        elif extension.lower() == 'gsf':
+            reader.readGSF(**options)
+        elif extension.lower() == 'gtx':
+            reader.readGTX(**options)
+        elif extension.lower() == 'bin':
+            reader.readBIN(**options)
+        else:
+            raise ValueError('Unsupported grid format {!r}'.format(extension))
 
     def getMainHeadValues(self):
         is_dms = self.isg_model_format == '2.0' and self.head['coord_units']['value'] == 'dms'
@@ -48,101 +161,149 @@ class Model:
         }
         return array
 
+    def getMetadata(self) -> dict:
+        # Header values, with the bounds of the outer grid nodes in decimal degrees whatever the version and units
+        metadata = {slug: item.get('value') for slug, item in self.head.items()}
+        metadata.update(self.dd_bounds)
+        metadata['nrows'] = self.geometry.nrows
+        metadata['ncols'] = self.geometry.ncols
+        metadata['isg_format'] = self.isg_model_format
+        metadata['file_path'] = self.file_path
+        return metadata
+
     def setBoundsManually(self, bounds) -> None:
-        self.dd_bounds['lat_min'] = bounds['lat_min']
-        self.dd_bounds['lat_max'] = bounds['lat_max']
-        self.dd_bounds['lon_min'] = bounds['lon_min']
-        self.dd_bounds['lon_max'] = bounds['lon_max']
+        self.setGeometry(GridGeometry.fromBounds(
+            bounds['lat_min'], bounds['lat_max'], bounds['lon_min'], bounds['lon_max'],
+            self.geometry.delta_lat, self.geometry.delta_lon, self.getRowsNumber(), self.getColsNumber()
+        ))
+
+    def setGeometry(self, geometry) -> None:
+        # Windows, padding and resampling give a model a new geometry; dd_bounds and the header follow it
+        self.geometry = geometry
+        self.dd_bounds = geometry.getBounds()
+        for slug, value in self.dd_bounds.items():
+            self.head[slug]['value'] = value
+        self.head['nrows']['value'] = geometry.nrows
+        self.head['ncols']['value'] = geometry.ncols
 
     def standardizeModel(self) -> None:
-        bound_slugs = ['lat_min', 'lat_max', 'lon_min', 'lon_max', 'delta_lat', 'delta_lon']
-        for slug, item in self.head.items():
-            if slug in bound_slugs:
-                if self.isg_model_format == '2.0' and self.head['coord_units']['value'] == 'dms':
-                    self.is_dms_format = True
-                    self.dd_bounds[slug] = dms_to_deg(item['value'])
-                else:
-                    self.dd_bounds[slug] = float(item['value'])
-
-        # Grid shift
-        if self.isg_model_format in ['1.0', '1.01']:
-            self.dd_bounds['lat_min'] = self.dd_bounds['lat_min'] + self.dd_bounds['delta_lat'] / 2
-            self.dd_bounds['lat_max'] = self.dd_bounds['lat_max'] - self.dd_bounds['delta_lat'] / 2
-            self.dd_bounds['lon_min'] = self.dd_bounds['lon_min'] + self.dd_bounds['delta_lon'] / 2
-            self.dd_bounds['lon_max'] = self.dd_bounds['lon_max'] - self.dd_bounds['delta_lon'] / 2
+        header_bounds = {}
+        for slug in BOUND_SLUGS:
+            if self.isg_model_format == '2.0' and self.head['coord_units']['value'] == 'dms':
+                self.is_dms_format = True
+                header_bounds[slug] = dms_to_deg(self.head[slug]['value'])
+            else:
+                header_bounds[slug] = float(self.head[slug]['value'])
+
+        # Grid shift: ISG 1.x headers give the outer cell edges, the geometry keeps the outer nodes
+        self.geometry = GridGeometry.fromBounds(
+            nrows=self.getRowsNumber(),
+            ncols=self.getColsNumber(),
+            registration='cell' if self.isg_model_format in ['1.0', '1.01'] else 'node',
+            **header_bounds
+        )
+        self.dd_bounds = self.geometry.getBounds()
 
-        # Set N-to-S convention
+        # Set N-to-S convention (a lazy grid applies it to each decoded row window)
         if self.isg_model_format == '2.0':
-            if self.head['data_ordering']['value'] == 'S-to-N, W-to-E':
-                matrix = []
-                for row in self.data:
-                    matrix_row = []
-                    for col in row:
-                        matrix_row.append(col)
-                    matrix.insert(0, matrix_row)
-                self.data = matrix
-            elif self.head['data_ordering']['value'] == 'N-to-S, E-to-W':
-                matrix = []
-                for row in self.data:
-                    matrix_row = []
-                    for col in row:
-                        matrix_row.insert(0, col)
-                    matrix.append(matrix_row)
-                self.data = matrix
-            elif self.head['data_ordering']['value'] == 'S-to-N, E-to-W':
-                matrix = []
-                for row in self.data:
-                    matrix_row = []
-                    for col in row:
-                        matrix_row.insert(0, col)
-                    matrix.insert(0, matrix_row)
-                self.data = matrix
+            if not self.isLazy():
+                if self.head['data_ordering']['value'] == 'S-to-N, W-to-E':
+                    self.data = np.ascontiguousarray(self.data[::-1, :])
+                elif self.head['data_ordering']['value'] == 'N-to-S, E-to-W':
+                    self.data = np.ascontiguousarray(self.data[:, ::-1])
+                elif self.head['data_ordering']['value'] == 'S-to-N, E-to-W':
+                    self.data = np.ascontiguousarray(self.data[::-1, ::-1])
             self.head['data_ordering']['value'] = 'N-to-S, W-to-E'
 
     def getStructureByVersion(self, version=None) -> dict:
         if not version:
             version = self.isg_model_format
-        structure = {}
-        for field in self.head_config_fields:
-            for value in field['values']:
-                if version in value['version']:
-                    structure[field['slug']] = {
-                        'keyword': value['keyword'],
-                        'type': value['type'],
-                        'format': value['format'],
-                    }
-        return structure
+        if version not in HEAD_SCHEMAS:
+            return {}
+        return HEAD_SCHEMAS[version].newHead()
 
-    def convertTo(self, path, extension) -> str:
+    def convertTo(self, path, extension, blocks=None, **options) -> str:
+        # Keyword options are passed on to the converter, e.g. compress or precision settings for CSV. blocks are
+        # the row blocks to write, by default read from the model
         prefix = datetime.now().strftime("%Y%m%d_%H%M%S_")
         tmp = None
         if extension.lower() == 'csv':
             tmp = tempfile.NamedTemporaryFile(delete=False, prefix=prefix, suffix='.csv', dir=path)
-            converter = FileFormat(self, tmp.name)
-            converter.convertToCSV()
+            converter = FileFormat(self, tmp.name, blocks)
+            converter.convertToCSV(**options)
+        elif extension.lower() == 'csv.gz':
+            tmp = tempfile.NamedTemporaryFile(delete=False, prefix=prefix, suffix='.csv.gz', dir=path)
+            converter = FileFormat(self, tmp.name, blocks)
+            converter.convertToCSV(compress=True, **options)
         elif extension.lower() == 'isg1.01':
             tmp = tempfile.NamedTemporaryFile(delete=False, prefix=prefix, suffix='.isg', dir=path)
-            converter = FileFormat(self, tmp.name)
-            converter.convertToISG(version='1.01')
+            converter = FileFormat(self, tmp.name, blocks)
+            converter.convertToISG(version='1.01', **options)
         elif extension.lower() == 'isg2.00':
             tmp = tempfile.NamedTemporaryFile(delete=False, prefix=prefix, suffix='.isg', dir=path)
-            converter = FileFormat(self, tmp.name)
-            converter.convertToISG(version='2.0')
+            converter = FileFormat(self, tmp.name, blocks)
+            converter.convertToISG(version='2.0', **options)
         elif extension.lower() == 'gsf':
             tmp = tempfile.NamedTemporaryFile(delete=False, prefix=prefix, suffix='.gsf', dir=path)
-            converter = FileFormat(self, tmp.name)
-            converter.convertToGSF()
+            converter = FileFormat(self, tmp.name, blocks)
+            converter.convertToGSF(**options)
         elif extension.lower() == 'tif':
             tmp = tempfile.NamedTemporaryFile(delete=False, prefix=prefix, suffix='.tif', dir=path)
-            converter = FileFormat(self, tmp.name)
-            converter.convertToTIF()
+            converter = FileFormat(self, tmp.name, blocks)
+            converter.convertToTIF(**options)
         elif extension.lower() == 'gri':
             tmp = tempfile.NamedTemporaryFile(delete=False, prefix=prefix, suffix='.gri', dir=path)
-            converter = FileFormat(self, tmp.name)
-            converter.convertToGRI()
+            converter = FileFormat(self, tmp.name, blocks)
+            converter.convertToGRI(**options)
+        elif extension.lower() == 'gtx':
+            tmp = tempfile.NamedTemporaryFile(delete=False, prefix=prefix, suffix='.gtx', dir=path)
+            converter = FileFormat(self, tmp.name, blocks)
+            converter.convertToGTX(**options)
+        elif extension.lower() == 'bin':
+            tmp = tempfile.NamedTemporaryFile(delete=False, prefix=prefix, suffix='.bin', dir=path)
+            converter = FileFormat(self, tmp.name, blocks)
+            converter.convertToBIN(**options)
+        else:
+            raise ValueError('Unsupported grid format {!r}'.format(extension))
         return tmp.name
 
-    def read(self, lines) -> None:
+    def convertToMany(self, path, extensions, workers=None, use_processes=None) -> dict:
+        # The text writers format their rows in Python while holding the GIL, so threads only overlap the file I/O
+        # and the numpy and GDAL work of the binary formats. By default text formats are converted in processes
+        workers = max(1, workers or len(extensions))
+        if use_processes is None:
+            use_processes = workers > 1 and any(extension.lower() in TEXT_FORMATS for extension in extensions)
+        if use_processes:
+            # Processes cannot share the row blocks; each worker gets the model once (not once per format) and
+            # converts whole formats
+            with ProcessPoolExecutor(max_workers=workers, initializer=set_worker_model, initargs=(self,)) as executor:
+                futures = {extension: executor.submit(convert_in_worker, path, extension) for extension in extensions}
+            return {extension: future.result() for extension, future in futures.items()}
+
+        futures = {}
+        for first in range(0, len(extensions), workers):
+            futures.update(self.convertInThreads(path, extensions[first:first + workers]))
+        return {extension: future.result() for extension, future in futures.items()}
+
+    def convertInThreads(self, path, extensions) -> dict:
+        # The grid is walked once for the group: every row block goes to all the converters, each reading from a
+        # bounded queue, so a lazy model is decoded once whatever the number of formats
+        queues = {extension: queue.Queue(maxsize=BLOCK_QUEUE_SIZE) for extension in extensions}
+        with ThreadPoolExecutor(max_workers=len(extensions)) as executor:
+            futures = {
+                extension: executor.submit(convert_from_queue, self, path, extension, queues[extension])
+                for extension in extensions
+            }
+            try:
+                for item in self.iterRowBlocks():
+                    for block_queue in queues.values():
+                        block_queue.put(item)
+            finally:
+                for block_queue in queues.values():
+                    block_queue.put(None)
+        return futures
+
+    def read(self, lines, parse_data=True) -> None:
         for line in lines:
             if 'ISG format' in line:
                 self.isg_model_format = line[line.find('=') + 1:-1].strip()
@@ -150,57 +311,39 @@ class Model:
         if self.isg_model_format is None:
             print('Error')
             exit(1)
+        keyword_slugs = HEAD_SCHEMAS[self.isg_model_format].keyword_slugs if self.isg_model_format in HEAD_SCHEMAS else {}
         structure = self.getStructureByVersion()
         in_comment_section = True
         in_header_section = False
-        in_data_section = False
-        matrix = []
+        data_lines = []
 
-        for line in lines:
+        for index, line in enumerate(lines):
             skip_line = False
             if 'begin_of_head' in line:
                 in_comment_section = False
                 in_header_section = True
                 skip_line = True
             if 'end_of_head' in line:
-                in_header_section = False
-                in_data_section = True
-                skip_line = True
+                data_lines = lines[index + 1:]
+                break
             if not skip_line:
                 if in_comment_section:
                     self.comment_section.append(line)
                 elif in_header_section:
-                    numeric = False
-                    textual = False
-
                     separator_pos = line.find(':')
-                    if separator_pos > 0:
-                        textual = True
-                    else:
-                        numeric = True
+                    if separator_pos <= 0:
                         separator_pos = line.find('=')
 
-                    for slug, item in structure.items():
-                        if isinstance(item['keyword'], list) and line[0:separator_pos].rstrip() in item['keyword']:
-                            item['keyword'] = line[0:separator_pos].rstrip()
-                        if line[0:separator_pos].rstrip() == item['keyword']:
-                            if textual:
-                                item['value'] = line[separator_pos + 1:-1].strip()
-                            elif numeric:
-                                item['value'] = line[separator_pos + 1:-1].strip()
-                            break
-
-                elif in_data_section:
-                    array = []
-                    for item in line.split():
-                        try:
-                            array.append(float(item))
-                        except ValueError:
-                            pass
-                    matrix.append(array)
+                    # Keywords and their aliases map straight to the slug; the item keeps the keyword the file uses
+                    keyword = line[0:separator_pos].rstrip()
+                    slug = keyword_slugs.get(keyword)
+                    if slug is not None:
+                        structure[slug]['keyword'] = keyword
+                        structure[slug]['value'] = line[separator_pos + 1:-1].strip()
 
         self.head = structure
-        self.data = matrix
+        if parse_data:
+            self.data = parse_data_lines(data_lines, self.getRowsNumber(), self.getColsNumber(), self.dtype)
 
     def DEBUG_getModelsContent(self):
         for item in self.head:
@@ -218,209 +361,264 @@ class Model:
             if slug == 'ncols':
                 return int(item['value'])
 
+    def getCalculatedDeltas(self):
+        return self.geometry.delta_lat, self.geometry.delta_lon
+
     def getCoordAtPoint(self, row, col):
-        nrows = int(self.head['nrows']['value'])
-        ncols = int(self.head['ncols']['value'])
-        calculated_delta_lat = (self.dd_bounds['lat_max'] - self.dd_bounds['lat_min']) / (nrows - 1)
-        calculated_delta_lon = (self.dd_bounds['lon_max'] - self.dd_bounds['lon_min']) / (ncols - 1)
-        coord = {
-            'lat': self.dd_bounds['lat_min'] + calculated_delta_lat * (nrows - 1 - row),
-            'lon': self.dd_bounds['lon_max'] - calculated_delta_lon * (ncols - 1 - col),
-        }
-        return coord
+        lat, lon = self.geometry.rowcol_to_latlon(row, col)
+        return {'lat': lat, 'lon': lon}
+
+    def getPointAtCoord(self, lat, lon):
+        # Inverse of getCoordAtPoint, returning fractional row/col indices
+        row, col = self.geometry.latlon_to_rowcol(lat, lon)
+        return {'row': row, 'col': col}
+
+    def sample(self, lats, lons, method='bilinear'):
+        if method not in SAMPLE_METHODS:
+            raise ValueError('Unknown sampling method {!r}, expected one of {}'.format(method, SAMPLE_METHODS))
+        lats, lons = np.broadcast_arrays(np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64))
+        shape = (self.getRowsNumber(), self.getColsNumber())
+        flat_lats = lats.ravel()
+        flat_lons = lons.ravel()
+        values = np.empty(flat_lats.size)
+
+        for start in range(0, values.size, self.sample_chunk_size):
+            stop = start + self.sample_chunk_size
+            point = self.getPointAtCoord(flat_lats[start:stop], flat_lons[start:stop])
+            grid, row_offset = self.getSampleRows(point['row'][inside_grid(point['row'], point['col'], shape)], shape[0])
+            values[start:stop] = sample_grid(grid, point['row'], point['col'], method, shape, row_offset)
+        return values.reshape(lats.shape)
+
+    def sampleGrid(self, lats, lons, method='bilinear'):
+        # Samples the regular grid spanned by the 1-D lats (rows) and lons (columns) in separable passes
+        if method not in SAMPLE_METHODS:
+            raise ValueError('Unknown sampling method {!r}, expected one of {}'.format(method, SAMPLE_METHODS))
+        point = self.getPointAtCoord(np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64))
+        values = np.empty((point['row'].size, point['col'].size))
+        rows_per_chunk = max(1, self.sample_chunk_size // max(point['col'].size, 1))
+        for start in range(0, values.shape[0], rows_per_chunk):
+            stop = start + rows_per_chunk
+            values[start:stop] = resample_grid(self.data, point['row'][start:stop], point['col'], method)
+        return values
+
+    def getSampleRows(self, rows, nrows):
+        # A lazy model decodes only the row band the points (and a cubic stencil around them) touch
+        if not self.isLazy() or rows.size == 0:
+            return self.data, 0
+        row_start = max(int(np.floor(rows.min())) - 1, 0)
+        row_stop = min(int(np.floor(rows.max())) + 3, nrows)
+        if 2 * (row_stop - row_start) > nrows:
+            return self.data, 0
+        return self.lazy_grid.getRows(row_start, row_stop), row_start
+
+    def getRowsPerBlock(self):
+        return block_rows(self.getColsNumber(), self.memory_budget)
+
+    def iterRowBlocks(self, rows_per_block=None):
+        # Yields (first row, block) pairs; a lazy model decodes one block at a time, by default as many rows as
+        # fit in the memory budget
+        if rows_per_block is None:
+            rows_per_block = self.getRowsPerBlock()
+        nrows = self.getRowsNumber()
+        for start in range(0, nrows, rows_per_block):
+            stop = min(start + rows_per_block, nrows)
+            if self.isLazy():
+                yield start, self.lazy_grid.getRows(start, stop)
+            else:
+                yield start, self.data[start:stop]
 
     def getValueAtPoint(self, row, col):
-        return self.data[row][col]
+        if self.isLazy():
+            return float(self.lazy_grid.getValue(row, col))
+        return float(self.data[row, col])
+
+    def getDerivedModel(self, data, geometry, lazy_grid=None):  # -> ISGGeoidHandler.geoid.model.Model
+        # Derived models get their own header and bounds, so changing them never reaches this model. With a
+        # lazy_grid (data is None) the derived model stays lazy
+        model = Model(dtype=self.dtype)
+        model.memory_budget = self.memory_budget
+        model.file_path = self.file_path
+        model.isg_model_format = self.isg_model_format
+        model.comment_section = list(self.comment_section)
+        model.is_dms_format = self.is_dms_format
+        model.head = copy.deepcopy(self.head)
+        model.setGeometry(geometry)
+        if lazy_grid is not None:
+            model.setLazyGrid(lazy_grid)
+        else:
+            model.data = data
+        return model
+
+    def getWindow(self, row_start, row_stop, col_start, col_stop):  # -> ISGGeoidHandler.geoid.model.Model
+        # The window views the parent grid (or, for a lazy one, reads just these rows when they are streamed)
+        # instead of copying it. The view is read-only: derived models replace their grid instead of writing into
+        # the parent's
+        row_start, row_stop, col_start, col_stop = int(row_start), int(row_stop), int(col_start), int(col_stop)
+        geometry = self.geometry.getWindow(row_start, row_stop, col_start, col_stop)
+        if self.isLazy():
+            return self.getDerivedModel(None, geometry, WindowGrid(
+                self.lazy_grid, row_start, row_stop, col_start, col_stop, self.memory_budget
+            ))
+        data = self.data[row_start:row_stop, col_start:col_stop].view()
+        data.flags.writeable = False
+        return self.getDerivedModel(data, geometry)
+
+    def getPadded(self, top, bottom, left, right):  # -> ISGGeoidHandler.geoid.model.Model
+        # The padded grid is allocated once, filled with nodata, and the grid is copied into its centre
+        geometry = self.geometry.getPadded(top, bottom, left, right)
+        if self.isLazy():
+            return self.getDerivedModel(None, geometry, PaddedGrid(self.lazy_grid, top, bottom, left, right, self.memory_budget))
+        data = np.full(geometry.shape, NODATA_VALUE, dtype=self.dtype)
+        data[top:top + self.geometry.nrows, left:left + self.geometry.ncols] = self.data
+        return self.getDerivedModel(data, geometry)
+
+    def getSubsetByBounds(self, bounds):  # -> ISGGeoidHandler.geoid.model.Model
+        # Rectangular bounds select whole grid nodes, so the subset is a row/column slice
+        index_window = self.geometry.getIndexWindow(bounds)
+        if index_window is None:
+            print('Error')
+            return
+
+        subset = self.getWindow(*index_window)
+        subset.is_subset = True
+        return subset
 
     def defineGrid(self):
-        undulations = []
-        coordinates = []
+        import geopandas
+        lat, lon = self.geometry.rowcol_to_latlon(np.arange(self.data.shape[0]), np.arange(self.data.shape[1]))
+        lons, lats = np.meshgrid(lon, lat)
+        coordinates = geopandas.points_from_xy(lons.ravel(), lats.ravel())
+        return geopandas.GeoDataFrame(self.data.ravel(), geometry=coordinates, crs="epsg:4326")
+
+    def getSubsetByShapefile(self, shapefile):  # -> ISGGeoidHandler.geoid.model.Model
+        # The polygons are rasterized once onto the nodes of the window covering them
+        from rasterio import features
+        shapefile_bounds = shapefile.data.total_bounds
+        window = self.getSubsetByBounds({
+            'lat_min': float(shapefile_bounds[1]),
+            'lat_max': float(shapefile_bounds[3]),
+            'lon_min': float(shapefile_bounds[0]),
+            'lon_max': float(shapefile_bounds[2])
+        })
+        if window is None:
+            return
 
-        calculated_delta_lat = (self.dd_bounds['lat_max'] - self.dd_bounds['lat_min']) / (int(self.head['nrows']['value']) - 1)
-        calculated_delta_lon = (self.dd_bounds['lon_max'] - self.dd_bounds['lon_min']) / (int(self.head['ncols']['value']) - 1)
+        inside = features.geometry_mask(
+            shapefile.data.geometry, out_shape=window.geometry.shape, transform=window.geometry.getTransform(), invert=True
+        )
 
-        for row_index, line in enumerate(self.data):
-            for col_index, item in enumerate(line):
-                lat = self.dd_bounds['lat_max'] - row_index * calculated_delta_lat
-                lon = self.dd_bounds['lon_min'] + col_index * calculated_delta_lon
-                if undulations != -9999.0000:
-                    undulations.append(item)
-                    coordinates.append(Point(lon, lat))
-        return geopandas.GeoDataFrame(undulations, geometry=coordinates, crs="epsg:4326")
+        rows = np.flatnonzero(inside.any(axis=1))
+        cols = np.flatnonzero(inside.any(axis=0))
+        if rows.size == 0:
+            print('Error')
+            return
+
+        subset = window.getWindow(rows[0], rows[-1] + 1, cols[0], cols[-1] + 1)
+        inside = inside[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        if subset.isLazy():
+            subset.setLazyGrid(MaskedGrid(subset.lazy_grid, inside, self.memory_budget))
+        else:
+            subset.data = np.where(inside, subset.data, NODATA_VALUE)
+        subset.is_subset = True
+        return subset
 
     def getSubset(self, bounds=None, shapefile=None):  # -> ISGGeoidHandler.geoid.model.Model
         if bounds is not None:
-            polygon = Polygon([
-                (bounds['lon_min'], bounds['lat_min']),
-                (bounds['lon_min'], bounds['lat_max']),
-                (bounds['lon_max'], bounds['lat_max']),
-                (bounds['lon_max'], bounds['lat_min'])
-            ])
-            gdf_layer = geopandas.GeoDataFrame(index=[0], geometry=[polygon], crs="epsg:4326")
+            return self.getSubsetByBounds(bounds)
         elif shapefile is not None:
-            gdf_layer = shapefile.data
+            return self.getSubsetByShapefile(shapefile)
         else:
             print('Error')
             return
 
-        gdf = self.defineGrid()
-        gdf_layer.to_crs(gdf.crs)
-        subset_geoseries = gdf['geometry'].clip(gdf_layer['geometry'])
-        values = []
-        coord_list = []
-
-        for index, value in subset_geoseries.items():
-            coord_list.append(value)
-            values.append(gdf[0][index])
-
-        subset = geopandas.GeoDataFrame(values, geometry=coord_list)
-
-        lon_min = min(subset['geometry'], key=lambda item: item.x).x
-        lon_max = max(subset['geometry'], key=lambda item: item.x).x
-        lat_min = min(subset['geometry'], key=lambda item: item.y).y
-        lat_max = max(subset['geometry'], key=lambda item: item.y).y
-
-        calculated_model_delta_lat = (self.dd_bounds['lat_max'] - self.dd_bounds['lat_min']) / (int(self.head['nrows']['value']) - 1)
-        calculated_model_delta_lon = (self.dd_bounds['lon_max'] - self.dd_bounds['lon_min']) / (int(self.head['ncols']['value']) - 1)
-
-        nrows = int((lat_max - lat_min) / calculated_model_delta_lat)
-        ncols = int((lon_max - lon_min) / calculated_model_delta_lon)
-
-        calculated_delta_lat = (lat_max - lat_min) / (nrows - 1)
-        calculated_delta_lon = (lon_max - lon_min) / (ncols - 1)
-
-        matrix = [[-9999.0000 for x in range(ncols)] for y in range(nrows)]
-
-        model = None
-        for index, point in enumerate(subset['geometry']):
-            row = int((lat_max - point.y) / calculated_delta_lat)
-            col = int((point.x - lon_min) / calculated_delta_lon)
-            matrix[row][col] = subset[0][index]
-
-            model = Model()
-
-            model.dd_bounds['delta_lat'] = self.dd_bounds['delta_lat']
-            model.dd_bounds['delta_lon'] = self.dd_bounds['delta_lon']
-            model.dd_bounds['lat_min'] = lat_min
-            model.dd_bounds['lat_max'] = lat_max
-            model.dd_bounds['lon_min'] = lon_min
-            model.dd_bounds['lon_max'] = lon_max
-
-            model.data = matrix
-            model.head = self.head.copy()
-
-            model.head['delta_lat']['value'] = self.dd_bounds['delta_lat']
-            model.head['delta_lon']['value'] = self.dd_bounds['delta_lon']
-            model.head['lat_min']['value'] = lat_min
-            model.head['lat_max']['value'] = lat_max
-            model.head['lon_min']['value'] = lon_min
-            model.head['lon_max']['value'] = lon_max
-            model.head['nrows']['value'] = nrows
-            model.head['ncols']['value'] = ncols
-            model.is_subset = True
-
-        return model
-
-    def plot(self, path=None) -> None:
-        data = np.matrix(self.data)
+    def plot(self, path=None, show=True, bounds=None, file_name='plot.png') -> None:
+        # bounds restricts the map to a region (a tile) of the model; show=False only writes the PNG
+        import matplotlib.pyplot as plt
+        from .plotting import block_average, block_centres, get_basemap
+        model = self if bounds is None else self.getSubsetByBounds(bounds)
+        if model is None:
+            return
         fig = plt.figure(figsize=(12, 10))
         ax = fig.add_subplot()
 
-        m = Basemap(
-            projection='cyl',
-            resolution='i',
-            ax=ax,
-            llcrnrlat=self.dd_bounds['lat_min'],  # llcrnrlat: latitude of lower left hand corner of the desired map domain (degrees).
-            urcrnrlat=self.dd_bounds['lat_max'],  # urcrnrlat 	latitude of upper right hand corner of the desired map domain (degrees).
-            llcrnrlon=self.dd_bounds['lon_min'],  # llcrnrlon 	longitude of lower left hand corner of the desired map domain (degrees).
-            urcrnrlon=self.dd_bounds['lon_max']   # urcrnrlon 	longitude of upper right hand corner of the desired map domain (degrees).
+        # Block-average the grid to about one value per pixel of the axes; the value range comes from the same pass
+        data, nodata_mask, row_step, col_step, value_min, value_max = block_average(
+            model, int(ax.bbox.height), int(ax.bbox.width)
         )
+        if nodata_mask.all():
+            plt.close(fig)
+            print('Error')
+            return
 
-        lat = np.linspace(self.dd_bounds['lat_max'], self.dd_bounds['lat_min'], data.shape[0])
-        lon = np.linspace(self.dd_bounds['lon_min'], self.dd_bounds['lon_max'], data.shape[1])
+        # Cached per extent: llcrnrlat/urcrnrlat/llcrnrlon/urcrnrlon are the corners of the map domain (degrees)
+        m = get_basemap(model.dd_bounds, 'i')
+
+        lat, lon = block_centres(model.geometry, data.shape, row_step, col_step)
         xs, ys = np.meshgrid(lon, lat)
         x, y = m(xs, ys)
 
-        clevs = np.linspace(np.min(np.where(data < -9000, np.max(data), data)), np.max(data), 100)
-        cs = m.contourf(x, y, np.where(data < -9000, np.nan, data), clevs, cmap=plt.cm.turbo)
+        clevs = np.linspace(value_min, max(value_max, value_min + 1e-6), 100)
+        cs = m.contourf(x, y, np.where(nodata_mask, np.nan, data), clevs, cmap=plt.cm.turbo, ax=ax)
 
         try:
-            m.drawcoastlines()
+            m.drawcoastlines(ax=ax)
         except ValueError:
             pass
 
-        m.drawcountries()
-        meridian_step = int((self.dd_bounds['lon_max'] - self.dd_bounds['lon_min']) / 8)
-        parallel_step = int((self.dd_bounds['lat_max'] - self.dd_bounds['lat_min']) / 4)
+        m.drawcountries(ax=ax)
+        meridian_step = int((model.dd_bounds['lon_max'] - model.dd_bounds['lon_min']) / 8)
+        parallel_step = int((model.dd_bounds['lat_max'] - model.dd_bounds['lat_min']) / 4)
         if meridian_step == 0:
             meridian_step = 1
         if parallel_step == 0:
             parallel_step = 1
 
-        m.drawmeridians(range(-180, 180, meridian_step), labels=[False, False, True, True])
-        m.drawparallels(range(-90, 90, parallel_step), labels=[True, False, False, False])
+        m.drawmeridians(range(-180, 180, meridian_step), labels=[False, False, True, True], ax=ax)
+        m.drawparallels(range(-90, 90, parallel_step), labels=[True, False, False, False], ax=ax)
 
-        cbar = m.colorbar(cs, location='right', pad="2%", ticks=np.linspace(np.min(np.where(data < -9000, np.max(data), data)), np.max(data), 5))
+        cbar = m.colorbar(cs, location='right', pad="2%", ticks=np.linspace(value_min, value_max, 5), ax=ax)
         cbar.set_label('Undulation N [m]')
-        plt.xlabel('Longitude', labelpad=40)
-        plt.ylabel('Latitude', labelpad=40)
-        plt.title(self.head['model_name']['value'], pad=30)
+        ax.set_xlabel('Longitude', labelpad=40)
+        ax.set_ylabel('Latitude', labelpad=40)
+        ax.set_title(model.head['model_name']['value'], pad=30)
 
         if path:
-            if path is not None:
-                path = path + '/'
-            plt.savefig(path + 'plot.png')
-        plt.show()
+            fig.savefig(os.path.join(path, file_name))
+        if show:
+            plt.show()
+        else:
+            plt.close(fig)
 
     def interpolate(self, lon_step, lat_step, method) -> None:
-        row, col = 0, 0
-        lat_list, lon_list, und_list = [], [], []
-        while row < self.getRowsNumber():
-            while col < self.getColsNumber():
-                coord = self.getCoordAtPoint(row, col)
-                undulation = self.getValueAtPoint(row, col)
-                if undulation > -9000:
-                    und_list.append(undulation)
-                    lat_list.append(coord['lat'])
-                    lon_list.append(coord['lon'])
-                col += 1
-            row += 1
-            col = 0
-
-        coord_list = list(zip(lon_list, lat_list))
-
         if method == 'nearest':
-            interpolator = interpolate.NearestNDInterpolator(coord_list, und_list)
+            sample_method = 'nearest'
         elif method == 'linear':
-            interpolator = interpolate.LinearNDInterpolator(coord_list, und_list)
+            sample_method = 'bilinear'
         elif method == 'cubic':
-            interpolator = interpolate.CloughTocher2DInterpolator(coord_list, und_list)
+            sample_method = 'bicubic'
         else:
             print('Error')
             return
 
-        self.data = []
-        self.dd_bounds['delta_lat'] = lat_step
-        self.dd_bounds['delta_lon'] = lon_step
-
-        lat = self.dd_bounds['lat_max']
-        while lat >= self.dd_bounds['lat_min']:
-            lon = self.dd_bounds['lon_max']
-            row = []
-            while lon >= self.dd_bounds['lon_min']:
-                value = interpolator(lon, lat)
-                if math.isnan(value):
-                    row.append(-9999.00)
-                else:
-                    row.append(float(value))
-                lon -= lon_step
-            self.data.append(row)
-            lat -= lat_step
-
-        self.head['nrows']['value'] = len(self.data)
-        self.head['ncols']['value'] = len(self.data[0])
+        # Target nodes are anchored at the north-east corner, as before, and stored N-to-S, W-to-E
+        geometry = self.geometry
+        nrows = int(math.floor((geometry.lat_max - geometry.lat_min) / lat_step + 1e-9)) + 1
+        ncols = int(math.floor((geometry.lon_max - geometry.lon_min) / lon_step + 1e-9)) + 1
+        lats = geometry.lat_max - np.arange(nrows) * lat_step
+        lons = geometry.lon_max - np.arange(ncols - 1, -1, -1) * lon_step
+
+        if self.isLazy():
+            # The target rows are computed when they are streamed, from the source rows their stencils use
+            point = self.getPointAtCoord(lats, lons)
+            self.setLazyGrid(ResampledGrid(self.lazy_grid, point['row'], point['col'], sample_method, self.memory_budget))
+        else:
+            self.data = self.sampleGrid(lats, lons, sample_method)
+        self.setGeometry(GridGeometry(
+            float(lats[-1]), geometry.lat_max, float(lons[0]), geometry.lon_max, lat_step, lon_step, nrows, ncols
+        ))
 
-    def createSubmodel(self, directory, output_format, bounds=None, shapefile_path=None, interpolation=None, convert_shapefile_to_bounds=False, optimize_dimensions=True):
+    def getSubmodel(self, bounds=None, shapefile_path=None, interpolation=None, convert_shapefile_to_bounds=False, optimize_dimensions=True):  # -> ISGGeoidHandler.geoid.model.Model
+        # Every step derives a new model, so the source model can be reused for further submodels
         model = self
         if not optimize_dimensions:
             if shapefile_path is not None or bounds is not None:
@@ -437,43 +635,19 @@ class Model:
                 else:
                     optimizing_bounds_dict = bounds
 
-                modified = False
-                while model.dd_bounds['lat_min'] > optimizing_bounds_dict['lat_min']:
-                    modified = True
-                    row = []
-                    for i in range(len(model.data[0])):
-                        row.append(-9999)
-                    model.data.append(row)
-                    model.dd_bounds['lat_min'] -= model.dd_bounds['delta_lat']
-                while model.dd_bounds['lat_max'] < optimizing_bounds_dict['lat_max']:
-                    modified = True
-                    row = []
-                    for i in range(len(model.data[0])):
-                        row.append(-9999)
-                    model.data.insert(0, row)
-                    model.dd_bounds['lat_max'] += model.dd_bounds['delta_lat']
-                while model.dd_bounds['lon_min'] > optimizing_bounds_dict['lon_min']:
-                    modified = True
-                    for row in model.data:
-                        row.insert(0, -9999)
-                    model.dd_bounds['lon_min'] -= model.dd_bounds['delta_lon']
-                while model.dd_bounds['lon_max'] < optimizing_bounds_dict['lon_max']:
-                    modified = True
-                    for row in model.data:
-                        row.append(-9999)
-                    model.dd_bounds['lon_max'] += model.dd_bounds['delta_lon']
-                if modified:
-                    model.head['lat_min']['value'] = model.dd_bounds['lat_min']
-                    model.head['lat_max']['value'] = model.dd_bounds['lat_max']
-                    model.head['lon_min']['value'] = model.dd_bounds['lon_min']
-                    model.head['lon_max']['value'] = model.dd_bounds['lon_max']
-                    model.head['nrows']['value'] = int((model.dd_bounds['lat_max'] - model.dd_bounds['lat_min']) / model.dd_bounds['delta_lat'] + 1)
-                    model.head['ncols']['value'] = int((model.dd_bounds['lon_max'] - model.dd_bounds['lon_min']) / model.dd_bounds['delta_lon'] + 1)
+                # Whole rows and columns of nodata are added until the grid covers the requested bounds
+                geometry = model.geometry
+                pad_bottom = max(math.ceil((geometry.lat_min - optimizing_bounds_dict['lat_min']) / geometry.delta_lat - 1e-9), 0)
+                pad_top = max(math.ceil((optimizing_bounds_dict['lat_max'] - geometry.lat_max) / geometry.delta_lat - 1e-9), 0)
+                pad_left = max(math.ceil((geometry.lon_min - optimizing_bounds_dict['lon_min']) / geometry.delta_lon - 1e-9), 0)
+                pad_right = max(math.ceil((optimizing_bounds_dict['lon_max'] - geometry.lon_max) / geometry.delta_lon - 1e-9), 0)
+                if pad_bottom or pad_top or pad_left or pad_right:
+                    model = model.getPadded(pad_top, pad_bottom, pad_left, pad_right)
 
         lon_step, lat_step, method = None, None, None
         if interpolation is not None:
-            lon_step = interpolation['lat_deg']
-            lat_step = interpolation['lon_deg']
+            lon_step = interpolation['lon_deg']
+            lat_step = interpolation['lat_deg']
             method = None
             if interpolation['method'] == 'nn':
                 method = 'nearest'
@@ -541,23 +715,39 @@ class Model:
 
         else:  # entire model
             if interpolation is not None:
+                # interpolate replaces the grid of the model it runs on, so it runs on a window over the whole grid
+                model = model.getWindow(0, model.geometry.nrows, 0, model.geometry.ncols)
                 model.interpolate(lon_step, lat_step, method)
-            pass
 
-        print("Creating sub-model plot...")
-        model.plot(path=directory)
+        return model
+
+    def createSubmodel(self, directory, output_format, bounds=None, shapefile_path=None, interpolation=None, convert_shapefile_to_bounds=False, optimize_dimensions=True, plot='full'):
+        # plot: 'full' draws Model.plot as before, 'preview' writes a quick headless PNG, None skips plotting
+        if plot not in ['full', 'preview', None, False]:
+            raise ValueError('Unknown plot mode {!r}, expected \'full\', \'preview\' or None'.format(plot))
+        model = self.getSubmodel(bounds, shapefile_path, interpolation, convert_shapefile_to_bounds, optimize_dimensions)
+
+        if plot == 'full':
+            print("Creating sub-model plot...")
+            model.plot(path=directory)
+        elif plot == 'preview':
+            from .plotting import render_preview
+            print("Creating sub-model preview...")
+            render_preview(model, os.path.join(directory, 'plot.png'))
 
         print("Converting sub-model...")
+        saved_file = None
         if output_format == 'isg1.01':
-            model.convertTo(directory, 'isg1.01')
+            saved_file = model.convertTo(directory, 'isg1.01')
         elif output_format == 'isg2.00':
-            model.convertTo(directory, 'isg2.00')
+            saved_file = model.convertTo(directory, 'isg2.00')
         elif output_format == 'csv':
-            model.convertTo(directory, 'csv')
+            saved_file = model.convertTo(directory, 'csv')
         elif output_format == 'gsf':
-            model.convertTo(directory, 'gsf')
+            saved_file = model.convertTo(directory, 'gsf')
         elif output_format == 'tif':
-            model.convertTo(directory, 'tif')
+            saved_file = model.convertTo(directory, 'tif')
         elif output_format == 'gri':
-            model.convertTo(directory, 'gri')
+            saved_file = model.convertTo(directory, 'gri')
         print("Sub-model created!")
+        return saved_file
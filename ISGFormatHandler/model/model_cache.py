@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+from .grid_geometry import GridGeometry
+
+CACHE_VERSION = 2
+HASH_CHUNK_SIZE = 1 << 24
+
+
+def cache_paths(path, cache_dir=None):
+    if cache_dir is None:
+        base = path
+    else:
+        # Several sources may share a file name, so the cache name also encodes the source location
+        location = hashlib.sha1(os.path.abspath(path).encode('utf8')).hexdigest()[:12]
+        base = os.path.join(cache_dir, os.path.basename(path) + '.' + location)
+    return base + '.cache.json', base + '.cache.npy'
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_stat(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def load_cache(model, path, cache_dir=None) -> bool:
+    meta_path, grid_path = cache_paths(path, cache_dir)
+    try:
+        with open(meta_path, encoding='utf8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if not isinstance(meta, dict) or meta.get('cache_version') != CACHE_VERSION:
+        return False
+
+    # A truncated or foreign sidecar is a cache miss like a stale one; the model is only set from a complete one
+    try:
+        if meta['dtype'] != model.dtype.str:
+            return False
+        # Size and mtime decide quickly; a touched or copied file is accepted when its content hash still matches
+        stat = source_stat(path)
+        source = meta['source']
+        if stat['size'] != source['size']:
+            return False
+        if stat['mtime_ns'] != source['mtime_ns']:
+            if hash_file(path) != source['sha256']:
+                return False
+            source['mtime_ns'] = stat['mtime_ns']
+            write_json(meta_path, meta)
+
+        head = meta['head']
+        shape = (int(head['nrows']['value']), int(head['ncols']['value']))
+        geometry = GridGeometry(*meta['geometry'])
+        isg_model_format = meta['isg_model_format']
+        comment_section = meta['comment_section']
+        is_dms_format = meta['is_dms_format']
+    except (KeyError, TypeError, ValueError):
+        return False
+
+    try:
+        data = np.load(grid_path, mmap_mode='r')
+    except (OSError, ValueError):
+        return False
+    if data.shape != shape or data.shape != geometry.shape:
+        return False
+
+    model.file_path = path
+    model.isg_model_format = isg_model_format
+    model.comment_section = comment_section
+    model.head = head
+    model.geometry = geometry
+    model.dd_bounds = model.geometry.getBounds()
+    model.is_dms_format = is_dms_format
+    model.data = data
+    return True
+
+
+def save_cache(model, path, cache_dir=None) -> None:
+    meta_path, grid_path = cache_paths(path, cache_dir)
+    source = source_stat(path)
+    source['sha256'] = hash_file(path)
+    meta = {
+        'cache_version': CACHE_VERSION,
+        'source': source,
+        'dtype': model.dtype.str,
+        'isg_model_format': model.isg_model_format,
+        'comment_section': model.comment_section,
+        'head': model.head,
+        'geometry': list(model.geometry),
+        'is_dms_format': model.is_dms_format,
+    }
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+    tmp_grid_path = grid_path + '.tmp'
+    with open(tmp_grid_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(model.data))
+    os.replace(tmp_grid_path, grid_path)
+    write_json(meta_path, meta)
+
+
+def write_json(path, content):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(content, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
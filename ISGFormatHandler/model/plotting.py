@@ -0,0 +1,123 @@
+import functools
+import math
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.ticker import AutoLocator
+from mpl_toolkits.basemap import Basemap
+
+from .config import NODATA_THRESHOLD
+
+PREVIEW_SIZE = 512
+PREVIEW_RESOLUTION = 'l'
+EXTENT_DECIMALS = 6
+AVERAGE_BLOCK_CELLS = 1 << 22
+
+
+@functools.lru_cache(maxsize=32)
+def cached_basemap(lat_min, lat_max, lon_min, lon_max, resolution):
+    return Basemap(
+        projection='cyl',
+        resolution=resolution,
+        llcrnrlat=lat_min,
+        urcrnrlat=lat_max,
+        llcrnrlon=lon_min,
+        urcrnrlon=lon_max
+    )
+
+
+def get_basemap(bounds, resolution='i'):
+    # Building a Basemap loads and clips the coastline database, so one instance is kept per extent and resolution;
+    # drawing on an explicit ax keeps the instance reusable across figures
+    extent = [round(float(bounds[slug]), EXTENT_DECIMALS) for slug in ['lat_min', 'lat_max', 'lon_min', 'lon_max']]
+    return cached_basemap(*extent, resolution)
+
+
+def decimate(model, max_rows, max_cols):
+    # Keeps every step-th node so that the grid fits in max_rows x max_cols, picking them block by block
+    nrows, ncols = model.geometry.shape
+    row_step = max(1, math.ceil(nrows / max_rows))
+    col_step = max(1, math.ceil(ncols / max_cols))
+    grid = np.concatenate([block[-start % row_step::row_step, ::col_step] for start, block in model.iterRowBlocks()])
+    return grid, grid < NODATA_THRESHOLD, row_step, col_step
+
+
+def block_average(model, max_rows, max_cols):
+    # Averages the valid nodes of row_step x col_step blocks so that the grid fits in max_rows x max_cols.
+    # The grid is read one band of blocks at a time (a lazy model is never decoded whole) and the value range
+    # of the full resolution grid is found in the same pass
+    nrows, ncols = model.geometry.shape
+    row_step = max(1, math.ceil(nrows / max_rows))
+    col_step = max(1, math.ceil(ncols / max_cols))
+    out_rows = math.ceil(nrows / row_step)
+    out_cols = math.ceil(ncols / col_step)
+    sums = np.zeros((out_rows, out_cols))
+    counts = np.zeros((out_rows, out_cols), dtype=np.int64)
+    value_min, value_max = np.inf, -np.inf
+
+    rows_per_block = row_step * max(1, AVERAGE_BLOCK_CELLS // (row_step * ncols))
+    for start, block in model.iterRowBlocks(rows_per_block):
+        valid = block >= NODATA_THRESHOLD
+        if valid.any():
+            value_min = min(value_min, float(block[valid].min()))
+            value_max = max(value_max, float(block[valid].max()))
+        band_rows = math.ceil(block.shape[0] / row_step)
+        padding = ((0, band_rows * row_step - block.shape[0]), (0, out_cols * col_step - ncols))
+        values = np.pad(np.where(valid, block, 0), padding).reshape(band_rows, row_step, out_cols, col_step)
+        valid = np.pad(valid, padding).reshape(band_rows, row_step, out_cols, col_step)
+        band = slice(start // row_step, start // row_step + band_rows)
+        sums[band] = values.sum(axis=(1, 3))
+        counts[band] = valid.sum(axis=(1, 3))
+
+    nodata_mask = counts == 0
+    return sums / np.maximum(counts, 1), nodata_mask, row_step, col_step, value_min, value_max
+
+
+def block_centres(geometry, shape, row_step, col_step):
+    # Coordinates of the centre node of every block, limited to the last node of partial blocks
+    rows = np.minimum(np.arange(shape[0]) * row_step + (row_step - 1) / 2, geometry.nrows - 1)
+    cols = np.minimum(np.arange(shape[1]) * col_step + (col_step - 1) / 2, geometry.ncols - 1)
+    return geometry.rowcol_to_latlon(rows, cols)
+
+
+def image_extent(geometry, shape, row_step, col_step):
+    # Each displayed value stands for a row_step x col_step block of nodes starting at its own node
+    return [
+        geometry.lon_min - geometry.delta_lon / 2,
+        geometry.lon_min + geometry.delta_lon * (shape[1] * col_step - 0.5),
+        geometry.lat_max - geometry.delta_lat * (shape[0] * row_step - 0.5),
+        geometry.lat_max + geometry.delta_lat / 2,
+    ]
+
+
+def render_preview(model, path, size=PREVIEW_SIZE, resolution=PREVIEW_RESOLUTION):
+    # Headless quick-look PNG: a decimated grid drawn with imshow on an Agg figure, without pyplot or a display
+    grid, nodata_mask, row_step, col_step = decimate(model, size, size)
+    values = np.ma.masked_array(grid, nodata_mask)
+
+    fig = Figure(figsize=(8, 6.5))
+    ax = fig.add_subplot()
+    image = ax.imshow(
+        values,
+        extent=image_extent(model.geometry, grid.shape, row_step, col_step),
+        origin='upper',
+        cmap='turbo',
+        interpolation='nearest'
+    )
+    m = get_basemap(model.dd_bounds, resolution)
+    try:
+        m.drawcoastlines(ax=ax, linewidth=0.5)
+    except ValueError:
+        pass
+    m.drawcountries(ax=ax, linewidth=0.3)
+    # Basemap clears the ticks when it draws; degrees on the axes replace the meridian and parallel labels
+    ax.xaxis.set_major_locator(AutoLocator())
+    ax.yaxis.set_major_locator(AutoLocator())
+    ax.set_xlim(model.geometry.lon_min, model.geometry.lon_max)
+    ax.set_ylim(model.geometry.lat_min, model.geometry.lat_max)
+
+    cbar = fig.colorbar(image, ax=ax, pad=0.02)
+    cbar.set_label('Undulation N [m]')
+    ax.set_xlabel('Longitude')
+    ax.set_ylabel('Latitude')
+    ax.set_title(model.head['model_name']['value'])
+    fig.savefig(path, dpi=100)
@@ -0,0 +1,141 @@
+import numpy as np
+
+from .config import NODATA_THRESHOLD, NODATA_VALUE
+
+SAMPLE_METHODS = ('nearest', 'bilinear', 'bicubic')
+EDGE_TOLERANCE = 1e-9
+
+
+def cubic_weights(t):
+    # Keys cubic convolution kernel (a = -0.5) for the nodes at offsets -1, 0, 1, 2
+    t2 = t * t
+    t3 = t2 * t
+    return (
+        (-t3 + 2 * t2 - t) / 2,
+        (3 * t3 - 5 * t2 + 2) / 2,
+        (-3 * t3 + 4 * t2 + t) / 2,
+        (t3 - t2) / 2,
+    )
+
+
+def inside_grid(rows, cols, shape):
+    nrows, ncols = shape
+    return (
+        (rows >= -EDGE_TOLERANCE) & (rows <= nrows - 1 + EDGE_TOLERANCE) &
+        (cols >= -EDGE_TOLERANCE) & (cols <= ncols - 1 + EDGE_TOLERANCE)
+    )
+
+
+def sample_grid(grid, rows, cols, method, shape, row_offset=0):
+    # rows/cols are fractional indices on the full grid; grid may be a row band starting at row_offset
+    nrows, ncols = shape
+    values = np.full(rows.shape, NODATA_VALUE)
+    inside = inside_grid(rows, cols, shape)
+    rows = np.clip(rows[inside], 0, nrows - 1)
+    cols = np.clip(cols[inside], 0, ncols - 1)
+
+    if method == 'nearest':
+        result = grid[np.rint(rows).astype(np.intp) - row_offset, np.rint(cols).astype(np.intp)]
+        values[inside] = np.where(result < NODATA_THRESHOLD, NODATA_VALUE, result)
+        return values
+
+    row_0 = np.minimum(np.floor(rows).astype(np.intp), max(nrows - 2, 0))
+    col_0 = np.minimum(np.floor(cols).astype(np.intp), max(ncols - 2, 0))
+    row_fraction = rows - row_0
+    col_fraction = cols - col_0
+
+    # Stencil indices for offsets -1, 0, 1, 2, clamped to the grid edges
+    stencil_rows = [np.clip(row_0 + step, 0, nrows - 1) - row_offset for step in range(-1, 3)]
+    stencil_cols = [np.clip(col_0 + step, 0, ncols - 1) for step in range(-1, 3)]
+
+    def node(row_step, col_step, row_weight, col_weight):
+        # A nodata node only spoils the point when its weight is nonzero; its value is zeroed so it never leaks in
+        value = grid[stencil_rows[row_step + 1], stencil_cols[col_step + 1]]
+        missing = value < NODATA_THRESHOLD
+        used = (np.abs(row_weight) > EDGE_TOLERANCE) & (np.abs(col_weight) > EDGE_TOLERANCE)
+        return np.where(missing, 0, value), missing & used
+
+    (v00, n00), (v01, n01) = node(0, 0, 1 - row_fraction, 1 - col_fraction), node(0, 1, 1 - row_fraction, col_fraction)
+    (v10, n10), (v11, n11) = node(1, 0, row_fraction, 1 - col_fraction), node(1, 1, row_fraction, col_fraction)
+    result = (v00 * (1 - col_fraction) + v01 * col_fraction) * (1 - row_fraction) + \
+             (v10 * (1 - col_fraction) + v11 * col_fraction) * row_fraction
+    nodata = n00 | n01 | n10 | n11
+
+    if method == 'bicubic':
+        row_weights = cubic_weights(row_fraction)
+        col_weights = cubic_weights(col_fraction)
+        cubic = np.zeros(rows.shape)
+        cubic_nodata = np.zeros(rows.shape, dtype=bool)
+        for i in range(4):
+            row_sum = np.zeros(rows.shape)
+            for j in range(4):
+                value, missing = node(i - 1, j - 1, row_weights[i], col_weights[j])
+                cubic_nodata |= missing
+                row_sum += col_weights[j] * value
+            cubic += row_weights[i] * row_sum
+        # Next to nodata cells the 4x4 stencil is incomplete, so those points keep the bilinear value
+        result = np.where(cubic_nodata, result, cubic)
+
+    values[inside] = np.where(nodata, NODATA_VALUE, result)
+    return values
+
+
+def axis_stencil(positions, size):
+    # Per target node: clamped source indices for offsets -1, 0, 1, 2 and the fraction past offset 0
+    inside = (positions >= -EDGE_TOLERANCE) & (positions <= size - 1 + EDGE_TOLERANCE)
+    positions = np.clip(positions, 0, size - 1)
+    base = np.minimum(np.floor(positions).astype(np.intp), max(size - 2, 0))
+    indices = [np.clip(base + step, 0, size - 1) for step in range(-1, 3)]
+    return indices, positions - base, inside
+
+
+def resample_axis(values, nodata, indices, fraction, axis, kernel):
+    # One separable pass along the given axis; a target node is nodata when a source node with a nonzero weight is.
+    # Nodata values are zeroed, so a node with zero weight (a target on a source node) never leaks into the sum
+    shape = [1, 1]
+    shape[axis] = -1
+    fraction = fraction.reshape(shape)
+    if kernel == 'cubic':
+        taps = zip(indices, cubic_weights(fraction))
+    else:
+        taps = zip(indices[1:3], (1 - fraction, fraction))
+
+    result = 0
+    result_nodata = False
+    for index, weight in taps:
+        missing = np.take(nodata, index, axis=axis)
+        result = result + weight * np.where(missing, 0, np.take(values, index, axis=axis))
+        result_nodata = result_nodata | (missing & (np.abs(weight) > EDGE_TOLERANCE))
+    return result, result_nodata
+
+
+def resample_grid(grid, rows, cols, method):
+    # rows/cols are 1-D fractional source indices of the target rows and columns (a tensor-product grid)
+    return resample_stencils(grid, axis_stencil(rows, grid.shape[0]), axis_stencil(cols, grid.shape[1]), method)
+
+
+def resample_stencils(grid, row_stencil, col_stencil, method):
+    # The stencils index grid, which may hold only the source rows the row stencil uses
+    row_indices, row_fraction, row_inside = row_stencil
+    col_indices, col_fraction, col_inside = col_stencil
+    nodata = grid < NODATA_THRESHOLD
+
+    if method == 'nearest':
+        nearest = np.ix_(
+            np.rint(row_indices[1] + row_fraction).astype(np.intp),
+            np.rint(col_indices[1] + col_fraction).astype(np.intp)
+        )
+        result = grid[nearest].astype(np.float64)
+        result_nodata = nodata[nearest]
+    else:
+        # Separable passes: first along the source columns (row direction), then along the source rows
+        result, result_nodata = resample_axis(grid, nodata, row_indices, row_fraction, 0, 'linear')
+        result, result_nodata = resample_axis(result, result_nodata, col_indices, col_fraction, 1, 'linear')
+        if method == 'bicubic':
+            cubic, cubic_nodata = resample_axis(grid, nodata, row_indices, row_fraction, 0, 'cubic')
+            cubic, cubic_nodata = resample_axis(cubic, cubic_nodata, col_indices, col_fraction, 1, 'cubic')
+            # Next to nodata cells the 4x4 stencil is incomplete, so those nodes keep the bilinear value
+            result = np.where(cubic_nodata, result, cubic)
+
+    result_nodata = result_nodata | ~(row_inside[:, np.newaxis] & col_inside[np.newaxis, :])
+    return np.where(result_nodata, NODATA_VALUE, result)
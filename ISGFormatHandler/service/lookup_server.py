@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import signal
+import numpy as np
+
+from ..model.config import NODATA_THRESHOLD
+from ..model.sampling import SAMPLE_METHODS
+from .model_pool import ModelPool
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Upper limit of a request line, about 400k points
+MAX_REQUEST_SIZE = 1 << 24
+# Seconds a connection closed after an oversized request waits for the client to stop sending
+CLOSE_TIMEOUT = 5.0
+
+
+def to_list(values):
+    # nodata becomes null in the JSON response
+    return [None if value < NODATA_THRESHOLD else value for value in values.tolist()]
+
+
+class LookupServer:
+    # Newline-delimited JSON over TCP or a Unix socket. Requests on a connection are answered in order:
+    #   {"id": 1, "model": "EGG97", "lats": [...], "lons": [...], "heights": [...], "method": "bilinear"}
+    #   -> {"id": 1, "undulations": [...], "orthometric_heights": [...]}
+    # "heights" (ellipsoidal) and "method" are optional; {"op": "info"} lists the models and
+    # {"op": "info", "model": "EGG97"} returns the bounds and shape of one
+
+    def __init__(self, pool, method='bilinear'):
+        if method not in SAMPLE_METHODS:
+            raise ValueError('Unknown sampling method {!r}, expected one of {}'.format(method, SAMPLE_METHODS))
+        self.pool = pool
+        self.method = method
+
+    async def answer(self, request):
+        if not isinstance(request, dict):
+            raise ValueError('Request must be a JSON object')
+        op = request.get('op', 'sample')
+        if op == 'info':
+            if 'model' not in request:
+                return {'models': self.pool.getNames()}
+            model = await self.pool.getModelAsync(request['model'])
+            return {'bounds': model.dd_bounds, 'shape': list(model.geometry.shape)}
+        if op != 'sample':
+            raise ValueError('Unknown op {!r}, expected \'sample\' or \'info\''.format(op))
+
+        for key in ['model', 'lats', 'lons']:
+            if key not in request:
+                raise ValueError('Missing {!r}'.format(key))
+        model = await self.pool.getModelAsync(request['model'])
+        undulations = model.sample(request['lats'], request['lons'], request.get('method', self.method))
+        response = {'undulations': to_list(undulations)}
+        if request.get('heights') is not None:
+            # H = h - N; a point without undulation or ellipsoidal height gets null
+            heights = np.asarray([np.nan if height is None else height for height in request['heights']], dtype=np.float64)
+            heights = np.broadcast_to(heights, undulations.shape)
+            valid = (undulations >= NODATA_THRESHOLD) & ~np.isnan(heights)
+            response['orthometric_heights'] = [
+                height - undulation if is_valid else None
+                for height, undulation, is_valid in zip(heights.tolist(), undulations.tolist(), valid.tolist())
+            ]
+        return response
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # The line is longer than MAX_REQUEST_SIZE, so where the next request starts is unknown: the
+                    # error is answered and the connection closed
+                    await self.reject(reader, writer, {'error': 'Request longer than {} bytes'.format(MAX_REQUEST_SIZE)})
+                    break
+                if not line:
+                    break
+                request = None
+                try:
+                    request = json.loads(line)
+                    response = await self.answer(request)
+                except (ValueError, TypeError, OSError) as e:
+                    # A bad request or a model file that cannot be read is answered, the connection stays open
+                    response = {'error': str(e)}
+                if isinstance(request, dict) and 'id' in request:
+                    response['id'] = request['id']
+                writer.write(json.dumps(response).encode('utf8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def reject(self, reader, writer, response):
+        writer.write(json.dumps(response).encode('utf8') + b'\n')
+        await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+        # The rest of the request is read and dropped until the client closes: closing with unread data would
+        # reset the connection and could lose the answer
+        try:
+            await asyncio.wait_for(self.discard(reader), CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+
+    async def discard(self, reader):
+        while await reader.read(1 << 16):
+            pass
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None, reuse_port=False):
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path=path, limit=MAX_REQUEST_SIZE)
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=MAX_REQUEST_SIZE, reuse_port=reuse_port)
+        async with server:
+            await server.serve_forever()
+
+
+def stop_server(signum, frame):
+    raise SystemExit(0)
+
+
+def run_worker(paths, pool_options, method, address):
+    # Every worker has its own pool; the grids they map are the same cache files
+    pool = ModelPool(paths, **pool_options)
+    try:
+        asyncio.run(LookupServer(pool, method).serve(*address, reuse_port=True))
+    except KeyboardInterrupt:
+        pass
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m ISGFormatHandler.service.lookup_server',
+        description='Serve geoid undulation lookups from a pool of read-only models.'
+    )
+    parser.add_argument('models', nargs='+', help='ISG files or directories of ISG files; models are named after the files')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix-socket', help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--workers', type=int, default=1, help='processes sharing the TCP port (default: 1)')
+    parser.add_argument('--max-models', type=int, default=8, help='models kept open by each worker (default: 8)')
+    parser.add_argument('--cache-dir', help='directory of the memory-mapped grid caches (default: next to the models)')
+    parser.add_argument('--method', choices=SAMPLE_METHODS, default='bilinear', help='default sampling method')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.workers > 1 and args.unix_socket is not None:
+        parser.error('several workers can only share a TCP port')
+    pool_options = {'max_models': args.max_models, 'cache_dir': args.cache_dir}
+    try:
+        pool = ModelPool.fromPaths(args.models, **pool_options)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.workers == 1:
+        print('Serving {} models on {}'.format(len(pool.paths), args.unix_socket or '{}:{}'.format(args.host, args.port)), flush=True)
+        try:
+            asyncio.run(LookupServer(pool, args.method).serve(args.host, args.port, args.unix_socket))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    pool.buildCaches()
+    address = (args.host, args.port)
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(pool.paths, pool_options, args.method, address), daemon=True)
+        for i in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    # On SIGTERM the parent stops its workers too, instead of leaving them holding the port
+    signal.signal(signal.SIGTERM, stop_server)
+    print('Serving {} models on {}:{} with {} workers'.format(len(pool.paths), args.host, args.port, args.workers), flush=True)
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import glob
+import math
+import os
+from collections import namedtuple
+import numpy as np
+
+from ..model.config import NODATA_THRESHOLD, NODATA_VALUE
+from ..model.model import Model
+from .model_pool import ModelPool
+
+CatalogEntry = namedtuple('CatalogEntry', ['name', 'path', 'geometry'])
+
+
+def wrap_lons(geometry, lons):
+    # Longitudes shifted by whole turns into (lon_max - 360, lon_max], so 0..360 and -180..180 grids are both matched
+    return lons + 360 * np.floor((geometry.lon_max - lons) / 360)
+
+
+def covers(geometry, lats, lons):
+    return (
+        (lats >= geometry.lat_min) & (lats <= geometry.lat_max) &
+        (wrap_lons(geometry, lons) >= geometry.lon_min)
+    )
+
+
+class ModelCatalog:
+    # Extents of many models read from their headers, indexed in bucket_size x bucket_size degree buckets. Every
+    # bucket lists the models overlapping it finest first (smallest delta_lat x delta_lon cell), so a point is routed
+    # by checking the few models of its bucket; grids are only read when a batch is sampled. The grids are cached
+    # (see ModelPool) only when a cache_dir is given, so sampling never writes into the model archive
+
+    def __init__(self, entries, bucket_size=1.0, pool=None, cache_dir=None):
+        if bucket_size <= 0 or not math.isclose(360 / bucket_size, round(360 / bucket_size)):
+            raise ValueError('bucket_size must divide 360 degrees, got {}'.format(bucket_size))
+        self.bucket_size = bucket_size
+        self.bucket_rows = int(math.floor(180 / bucket_size)) + 1
+        self.bucket_cols = int(round(360 / bucket_size))
+        # Finest first; ties go to the smaller extent, then to the name
+        self.entries = sorted(entries, key=lambda entry: (
+            entry.geometry.delta_lat * entry.geometry.delta_lon,
+            (entry.geometry.lat_max - entry.geometry.lat_min) * (entry.geometry.lon_max - entry.geometry.lon_min),
+            entry.name
+        ))
+        self.pool = pool
+        self.cache_dir = cache_dir
+
+        buckets = {}
+        for index, entry in enumerate(self.entries):
+            for key in self.getBucketKeys(entry.geometry):
+                buckets.setdefault(key, []).append(index)
+        # Buckets overlapped by the same models share one candidate list, and a batch is split by candidate list
+        # rather than by bucket: a global model alone covers tens of thousands of buckets
+        self.bucket_table = np.zeros((self.bucket_rows, self.bucket_cols), dtype=np.int32)
+        candidate_ids = {(): 0}
+        for (row, col), indices in buckets.items():
+            candidate_ids.setdefault(tuple(indices), len(candidate_ids))
+            self.bucket_table[row, col] = candidate_ids[tuple(indices)]
+        self.candidates = sorted(candidate_ids, key=candidate_ids.get)
+
+    @classmethod
+    def fromDirectory(cls, directory, pattern='*.isg', recursive=False, **options):  # -> ISGFormatHandler.service.model_catalog.ModelCatalog
+        # Files whose header cannot be read are left out and listed in catalog.skipped with the reason
+        paths = sorted(glob.glob(os.path.join(directory, '**', pattern) if recursive else os.path.join(directory, pattern), recursive=recursive))
+        entries = []
+        skipped = []
+        for path in paths:
+            model = Model()
+            try:
+                model.readHeader(path)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                skipped.append((path, '{}: {}'.format(type(e).__name__, e)))
+                continue
+            name = os.path.splitext(os.path.relpath(path, directory))[0]
+            entries.append(CatalogEntry(name, path, model.geometry))
+        catalog = cls(entries, **options)
+        catalog.skipped = skipped
+        return catalog
+
+    def getBucketKeys(self, geometry):
+        # Rows count from the south pole, columns from the prime meridian eastwards
+        row_start = max(math.floor((geometry.lat_min + 90) / self.bucket_size), 0)
+        row_stop = min(math.floor((geometry.lat_max + 90) / self.bucket_size), self.bucket_rows - 1)
+        col_start = math.floor(geometry.lon_min / self.bucket_size)
+        col_stop = math.floor(geometry.lon_max / self.bucket_size)
+        cols = {col % self.bucket_cols for col in range(col_start, min(col_stop, col_start + self.bucket_cols - 1) + 1)}
+        return [(row, col) for row in range(row_start, row_stop + 1) for col in cols]
+
+    def getNames(self):
+        return [entry.name for entry in self.entries]
+
+    def getPool(self):  # -> ISGFormatHandler.service.model_pool.ModelPool
+        if self.pool is None:
+            self.pool = ModelPool(
+                {entry.name: entry.path for entry in self.entries}, cache_dir=self.cache_dir, cache=self.cache_dir is not None
+            )
+        return self.pool
+
+    def route(self, lats, lons, rank=0):
+        # Index in self.entries of the finest model covering each point (rank=1 the next finest, ...), -1 where none does
+        lats, lons = np.broadcast_arrays(np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64))
+        flat_lats = lats.ravel()
+        flat_lons = lons.ravel()
+        routes = np.full(flat_lats.size, -1, dtype=np.intp)
+        rows = np.floor((flat_lats + 90) / self.bucket_size)
+        valid = (rows >= 0) & (rows < self.bucket_rows) & np.isfinite(flat_lons)
+        cols = np.floor(flat_lons[valid] / self.bucket_size).astype(np.int64) % self.bucket_cols
+        candidate_ids = np.zeros(flat_lats.size, dtype=np.int32)
+        candidate_ids[valid] = self.bucket_table[rows[valid].astype(np.intp), cols]
+
+        # Points grouped by candidate list
+        ids, inverse, counts = np.unique(candidate_ids, return_inverse=True, return_counts=True)
+        groups = np.split(np.argsort(inverse.ravel(), kind='stable'), np.cumsum(counts)[:-1])
+        for candidate_id, points in zip(ids, groups):
+            hits = np.zeros(points.size, dtype=np.intp)
+            for index in self.candidates[candidate_id]:
+                inside = covers(self.entries[index].geometry, flat_lats[points], flat_lons[points])
+                routes[points[inside & (hits == rank)]] = index
+                hits += inside
+                if hits.min() > rank:
+                    break
+        return routes.reshape(lats.shape)
+
+    def findModel(self, lat, lon):  # -> ISGFormatHandler.service.model_catalog.CatalogEntry
+        index = int(self.route(lat, lon))
+        return self.entries[index] if index >= 0 else None
+
+    def sample(self, lats, lons, method='bilinear', fallback=True):
+        # Returns the values and the index of the model each one comes from (-1 for nodata). Each model is read once
+        # per batch through the pool; with fallback a point that is nodata in its finest model tries the next one
+        lats, lons = np.broadcast_arrays(np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64))
+        flat_lats = lats.ravel()
+        flat_lons = lons.ravel()
+        values = np.full(flat_lats.size, NODATA_VALUE)
+        sources = np.full(flat_lats.size, -1, dtype=np.intp)
+        pending = np.arange(flat_lats.size)
+        rank = 0
+        while pending.size:
+            routes = self.route(flat_lats[pending], flat_lons[pending], rank)
+            for index in np.unique(routes[routes >= 0]):
+                entry = self.entries[index]
+                points = pending[routes == index]
+                result = self.getPool().getModel(entry.name).sample(
+                    flat_lats[points], wrap_lons(entry.geometry, flat_lons[points]), method
+                )
+                valid = result >= NODATA_THRESHOLD
+                values[points[valid]] = result[valid]
+                sources[points[valid]] = index
+            if not fallback:
+                break
+            pending = pending[(routes >= 0) & (sources[pending] < 0)]
+            rank += 1
+        return values.reshape(lats.shape), sources.reshape(lats.shape)
@@ -0,0 +1,96 @@
+import asyncio
+import glob
+import os
+from collections import OrderedDict
+import numpy as np
+
+from ..model.model import Model
+from ..model.model_cache import load_cache
+
+
+class ModelPool:
+    # Up to max_models ISG models stay open, the least recently used is closed first. Grids are loaded from the sidecar
+    # cache as read-only memory maps, so worker processes serving the same files share their pages instead of each
+    # holding a copy. Pooled models are shared: derive new ones with getSubmodel or getWindow instead of changing them.
+    # With cache=False the files are parsed on every load and nothing is written next to them
+
+    def __init__(self, paths, max_models=8, cache_dir=None, dtype=np.float64, cache=True):
+        self.paths = dict(paths)
+        self.max_models = max_models
+        self.cache_dir = cache_dir
+        self.cache = cache
+        self.dtype = np.dtype(dtype)
+        self.models = OrderedDict()
+        self.loading = {}
+
+    @classmethod
+    def fromPaths(cls, paths, **options):  # -> ISGFormatHandler.service.model_pool.ModelPool
+        # Files and directories of ISG files; a model is named after its file
+        names = {}
+        for path in paths:
+            files = sorted(glob.glob(os.path.join(path, '*.isg'))) if os.path.isdir(path) else [path]
+            for file in files:
+                name = os.path.splitext(os.path.basename(file))[0]
+                if name in names:
+                    raise ValueError('Model name {!r} is used by both {} and {}'.format(name, names[name], file))
+                names[name] = file
+        return cls(names, **options)
+
+    def getNames(self):
+        return sorted(self.paths)
+
+    def loadModel(self, path):  # -> ISGGeoidHandler.geoid.model.Model
+        model = Model(dtype=self.dtype)
+        model.retrieveByPath(path, cache=self.cache, cache_dir=self.cache_dir)
+        if not self.cache:
+            model.data.flags.writeable = False
+        elif model.data.flags.writeable:
+            # The cache has just been written: reopen it, so this process maps the grid like the other workers
+            cached = Model(dtype=self.dtype)
+            if load_cache(cached, path, self.cache_dir):
+                return cached
+            model.data.flags.writeable = False
+        return model
+
+    def buildCaches(self):
+        # Run once before starting the workers, so that they all map the same cache files
+        for path in self.paths.values():
+            self.loadModel(path)
+
+    def getOpenModel(self, name):
+        if name not in self.models:
+            return None
+        self.models.move_to_end(name)
+        return self.models[name]
+
+    def addModel(self, name, model):
+        self.models[name] = model
+        while len(self.models) > self.max_models:
+            self.models.popitem(last=False)
+
+    def getModel(self, name):  # -> ISGGeoidHandler.geoid.model.Model
+        model = self.getOpenModel(name)
+        if model is None:
+            if name not in self.paths:
+                raise ValueError('Unknown model {!r}'.format(name))
+            model = self.loadModel(self.paths[name])
+            self.addModel(name, model)
+        return model
+
+    async def getModelAsync(self, name):  # -> ISGGeoidHandler.geoid.model.Model
+        # A model that is not open is read in a thread, once however many tasks ask for it, while the event loop
+        # keeps serving the open ones; the pool itself is only changed from the event loop
+        model = self.getOpenModel(name)
+        if model is not None:
+            return model
+        if name not in self.paths:
+            raise ValueError('Unknown model {!r}'.format(name))
+        if name not in self.loading:
+            self.loading[name] = asyncio.ensure_future(asyncio.to_thread(self.loadModel, self.paths[name]))
+        try:
+            model = await asyncio.shield(self.loading[name])
+        finally:
+            self.loading.pop(name, None)
+        if self.getOpenModel(name) is None:
+            self.addModel(name, model)
+        return model
@@ -1,19 +1,17 @@
-import geopandas as gpd
-import matplotlib.pyplot as plt
-
-
 class Shapefile:
 
     def __init__(self):
         self.data = None
 
     def retrieveByPath(self, path):
+        import geopandas as gpd
         data = gpd.GeoDataFrame.from_file(path)
         data.crs = "EPSG:4326"
         self.data = data
 
     def plot(self):
         if self.data is not None:
+            import matplotlib.pyplot as plt
             self.data.plot()
             plt.show()
 
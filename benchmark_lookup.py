@@ -0,0 +1,141 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+import numpy as np
+
+# Load test of the lookup server on localhost: several connections send batches of random points inside the models
+# for a fixed time, one request in flight per connection. Reports the points per second and the request latencies.
+# Client and server share the machine, so the client's JSON work takes CPU from the server
+
+PAYLOADS_PER_MODEL = 16
+STARTUP_TIMEOUT = 120
+
+
+async def request(reader, writer, message):
+    writer.write(message)
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+def build_payloads(model_bounds, batch, with_heights, seed):
+    # Requests are encoded up front, so the client does not spend the measured time building them
+    rng = np.random.default_rng(seed)
+    payloads = []
+    for name, bounds in model_bounds.items():
+        for i in range(PAYLOADS_PER_MODEL):
+            message = {
+                'model': name,
+                'lats': rng.uniform(bounds['lat_min'], bounds['lat_max'], batch).tolist(),
+                'lons': rng.uniform(bounds['lon_min'], bounds['lon_max'], batch).tolist(),
+            }
+            if with_heights:
+                message['heights'] = rng.uniform(0, 2000, batch).tolist()
+            payloads.append((json.dumps(message) + '\n').encode('utf8'))
+    return payloads
+
+
+async def run_client(host, port, payloads, duration, latencies, errors, seed):
+    reader, writer = await asyncio.open_connection(host, port, limit=1 << 24)
+    deadline = time.perf_counter() + duration
+    order = random.Random(seed)
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await request(reader, writer, order.choice(payloads))
+        latencies.append(time.perf_counter() - start)
+        if 'error' in response:
+            errors.append(response['error'])
+    writer.close()
+
+
+async def run_load_test(host, port, connections, batch, duration, with_heights):
+    reader, writer = await asyncio.open_connection(host, port, limit=1 << 24)
+    names = (await request(reader, writer, b'{"op": "info"}\n'))['models']
+    model_bounds = {}
+    for name in names:
+        # Also opens every model before the measurement starts
+        model_bounds[name] = (await request(reader, writer, (json.dumps({'op': 'info', 'model': name}) + '\n').encode('utf8')))['bounds']
+    writer.close()
+
+    payloads = build_payloads(model_bounds, batch, with_heights, seed=0)
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(host, port, payloads, duration, latencies, errors, i) for i in range(connections)])
+    return names, np.array(latencies), errors, time.perf_counter() - start
+
+
+def port_in_use(host, port):
+    try:
+        socket.create_connection((host, port), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+
+def wait_for_server(host, port, process):
+    deadline = time.perf_counter() + STARTUP_TIMEOUT
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('The lookup server exited with status {}'.format(process.returncode))
+        if port_in_use(host, port):
+            return
+        time.sleep(0.2)
+    raise RuntimeError('The lookup server did not start in {} s'.format(STARTUP_TIMEOUT))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the ISGFormatHandler lookup server on localhost')
+    parser.add_argument('models', nargs='*', help='ISG files or directories to serve; without them a running server is used')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=1, help='server processes started with the models')
+    parser.add_argument('--cache-dir', help='cache directory of the started server')
+    parser.add_argument('--connections', type=int, default=8)
+    parser.add_argument('--batch', type=int, default=1000, help='points per request')
+    parser.add_argument('--duration', type=float, default=10, help='seconds')
+    parser.add_argument('--heights', action='store_true', help='send ellipsoidal heights and get orthometric heights back')
+    args = parser.parse_args()
+
+    host = '127.0.0.1'
+    server = None
+    if args.models:
+        # Another server on the port would answer in place of the one started here
+        if port_in_use(host, args.port):
+            parser.error('port {} is already in use; stop that server or choose another --port'.format(args.port))
+        command = [sys.executable, '-m', 'ISGFormatHandler.service.lookup_server', *args.models,
+                   '--host', host, '--port', str(args.port), '--workers', str(args.workers)]
+        if args.cache_dir is not None:
+            command += ['--cache-dir', args.cache_dir]
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+        # The server and its workers get their own process group, which is stopped as a whole
+        server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, start_new_session=True)
+    try:
+        if server is not None:
+            wait_for_server(host, args.port, server)
+        names, latencies, errors, seconds = asyncio.run(
+            run_load_test(host, args.port, args.connections, args.batch, args.duration, args.heights)
+        )
+    finally:
+        if server is not None:
+            try:
+                os.killpg(server.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            server.wait()
+
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000
+    print('models: {}'.format(', '.join(names)))
+    print('{} connections, {} points per request, {:.1f} s'.format(args.connections, args.batch, seconds))
+    print('{:.0f} points/s, {:.0f} requests/s, {} errors'.format(latencies.size * args.batch / seconds, latencies.size / seconds, len(errors)))
+    print('latency p50 {:.2f} ms, p90 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms'.format(p50, p90, p99, latencies.max() * 1000))
+    if errors:
+        print('first error: {}'.format(errors[0]))
+
+
+if __name__ == '__main__':
+    main()
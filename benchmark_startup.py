@@ -0,0 +1,59 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Measures the cold start of ISGFormatHandler in fresh interpreters: the package import alone and, when an ISG
+# file is given, a lookup worker's path (lazy read and a single bilinear sample)
+
+HEAVY_MODULES = ['geopandas', 'matplotlib', 'mpl_toolkits.basemap', 'scipy', 'shapely', 'rasterio', 'pandas', 'pyproj']
+
+SCENARIO_CODE = '''
+import json, sys, time
+start = time.perf_counter()
+import ISGFormatHandler as handler
+imported = time.perf_counter()
+path = {path!r}
+if path:
+    model = handler.Model()
+    model.retrieveByPath(path, lazy=True)
+    geometry = model.geometry
+    model.sample((geometry.lat_min + geometry.lat_max) / 2, (geometry.lon_min + geometry.lon_max) / 2)
+done = time.perf_counter()
+print(json.dumps({{
+    'import': imported - start,
+    'total': done - start,
+    'heavy': [name for name in {heavy!r} if name in sys.modules],
+}}))
+'''
+
+
+def run_scenario(path, repeat):
+    code = SCENARIO_CODE.format(path=path, heavy=HEAVY_MODULES)
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    runs = []
+    for i in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], env=env, check=True, capture_output=True, text=True)
+        runs.append(json.loads(output.stdout.splitlines()[-1]))
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start benchmark for ISGFormatHandler')
+    parser.add_argument('isg_file', nargs='?', help='ISG file to read lazily and sample once after the import')
+    parser.add_argument('--repeat', type=int, default=5, help='number of fresh interpreters per scenario')
+    args = parser.parse_args()
+
+    runs = run_scenario(args.isg_file, args.repeat)
+    imports = [run['import'] for run in runs]
+    totals = [run['total'] for run in runs]
+    print('import ISGFormatHandler: median {:.3f} s, min {:.3f} s'.format(statistics.median(imports), min(imports)))
+    if args.isg_file:
+        print('import + lazy read + sample: median {:.3f} s, min {:.3f} s'.format(statistics.median(totals), min(totals)))
+    print('heavy modules loaded: {}'.format(', '.join(runs[-1]['heavy']) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
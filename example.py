@@ -9,5 +9,5 @@ model.retrieveByPath(isg_file_path)
 # Plot the model
 model.plot()
 
-# The possible formats are 'isg1.01', 'isg2.00', 'csv', 'gsf', 'tif', 'gri'
+# The possible formats are 'isg1.01', 'isg2.00', 'csv', 'csv.gz', 'gsf', 'tif', 'gri', 'gtx', 'bin'
 model.convertTo(output_path, 'isg1.01')
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from ISGFormatHandler.converter.file_format import blockToString
+from ISGFormatHandler.model.config import NODATA_VALUE
+
+# Grid nodes of the test models: 21 x 31 nodes, 0.25 degrees apart, with a nodata gap inside and one at a corner
+LAT_MIN, LAT_MAX, LON_MIN, LON_MAX, DELTA = 40.0, 45.0, 5.0, 12.5, 0.25
+NROWS, NCOLS = 21, 31
+GAP = (10, 15)
+
+
+def make_grid():
+    lats = np.linspace(LAT_MAX, LAT_MIN, NROWS)[:, np.newaxis]
+    lons = np.linspace(LON_MIN, LON_MAX, NCOLS)[np.newaxis, :]
+    grid = np.round(40 + 5 * np.sin(np.radians(lats) * 7) + 3 * np.cos(np.radians(lons) * 5) + 0.01 * lons * lats, 4)
+    grid[GAP] = NODATA_VALUE
+    grid[0, :2] = NODATA_VALUE
+    return grid
+
+
+def write_isg(path, grid, version='2.0', data_ordering='N-to-S, W-to-E', nrows=None):
+    # ISG 1.01 headers give the outer cell edges, 2.0 headers the outer nodes
+    half = DELTA / 2 if version == '1.01' else 0
+    stored = grid[::-1] if data_ordering.startswith('S-to-N') else grid
+    stored = stored[:, ::-1] if data_ordering.endswith('E-to-W') else stored
+    head = [
+        ('model name', ':', 'TESTMODEL'),
+        ('model type', ':', 'gravimetric'),
+        ('units', ':', 'meters'),
+    ]
+    if version == '2.0':
+        head = [
+            ('model name', ':', 'TESTMODEL'), ('model year', ':', '2020'), ('model type', ':', 'gravimetric'),
+            ('data type', ':', 'geoid'), ('data units', ':', 'meters'), ('data format', ':', 'grid'),
+            ('data ordering', ':', data_ordering), ('ref ellipsoid', ':', 'GRS80'), ('ref frame', ':', 'ITRF2014'),
+            ('height datum', ':', '---'), ('tide system', ':', 'tide-free'), ('coord type', ':', 'geodetic'),
+            ('coord units', ':', 'deg'), ('map projection', ':', '---'), ('EPSG code', ':', '---'),
+        ]
+    head += [
+        ('lat min', '=', '{:.6f}'.format(LAT_MIN - half)), ('lat max', '=', '{:.6f}'.format(LAT_MAX + half)),
+        ('lon min', '=', '{:.6f}'.format(LON_MIN - half)), ('lon max', '=', '{:.6f}'.format(LON_MAX + half)),
+        ('delta lat', '=', '{:.6f}'.format(DELTA)), ('delta lon', '=', '{:.6f}'.format(DELTA)),
+        ('nrows', '=', str(grid.shape[0] if nrows is None else nrows)), ('ncols', '=', str(grid.shape[1])),
+        ('nodata', '=', '-9999.0000'),
+    ]
+    if version == '2.0':
+        head.append(('creation date', '=', '01/01/2020'))
+    head.append(('ISG format', '=', version))
+    with open(path, 'w', encoding='utf8') as f:
+        f.write('comment line\n\nbegin_of_head ================================================\n')
+        f.writelines('{:<14} {} {}\n'.format(keyword, delimiter, value) for keyword, delimiter, value in head)
+        f.write('end_of_head ==================================================\n')
+        f.write(blockToString(stored, ':10.4f', True))
+    return str(path)
+
+
+@pytest.fixture
+def grid():
+    return make_grid()
+
+
+@pytest.fixture
+def isg_path(tmp_path, grid):
+    return write_isg(tmp_path / 'model.isg', grid)
+
+
+@pytest.fixture
+def isg101_path(tmp_path, grid):
+    return write_isg(tmp_path / 'model101.isg', grid, version='1.01')
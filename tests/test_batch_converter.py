@@ -0,0 +1,18 @@
+import numpy as np
+
+from ISGFormatHandler.batch.batch_converter import build_jobs, iter_results
+
+from conftest import write_isg
+
+
+def test_peak_memory_belongs_to_each_file(tmp_path, grid):
+    # A large grid converted first must not raise the peak memory reported for the small one after it
+    large = write_isg(tmp_path / 'large.isg', np.tile(grid, (20, 20)))
+    small = write_isg(tmp_path / 'small.isg', grid)
+    jobs = build_jobs([large, small, small], defaults={'formats': ['gsf'], 'output_dir': str(tmp_path / 'converted')})
+    results = {}
+    for result in iter_results(jobs, workers=1):
+        assert result['error'] is None
+        results.setdefault(result['input'], []).append(result['peak_memory'])
+    assert max(results[small]) < min(results[large])
+    assert min(results[small]) > 0
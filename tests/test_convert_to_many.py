@@ -0,0 +1,99 @@
+import gzip
+import hashlib
+import math
+import threading
+import pytest
+
+from ISGFormatHandler.model.model import Model
+
+EXTENSIONS = ['isg1.01', 'isg2.00', 'csv', 'csv.gz', 'gsf', 'gri', 'gtx', 'bin']
+
+
+def digest(path):
+    # gzip headers carry the file name and time, so compressed files are compared by their content
+    with (gzip.open if path.endswith('.gz') else open)(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def serial_digests(model, path):
+    return {extension: digest(model.convertTo(path, extension)) for extension in EXTENSIONS}
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+@pytest.mark.parametrize('use_processes', [False, True])
+def test_convert_to_many_matches_serial_exports(isg_path, tmp_path, lazy, use_processes):
+    model = Model()
+    model.retrieveByPath(isg_path, lazy=lazy)
+    model.memory_budget = 20000
+    outputs = model.convertToMany(str(tmp_path), EXTENSIONS, use_processes=use_processes)
+    assert {extension: digest(path) for extension, path in outputs.items()} == serial_digests(model, str(tmp_path))
+
+
+def test_convert_to_many_decodes_a_lazy_grid_once(isg_path, tmp_path):
+    model = Model()
+    model.retrieveByPath(isg_path, lazy=True)
+    model.memory_budget = 20000
+    decoded = []
+    get_rows = model.lazy_grid.getRows
+    model.lazy_grid.getRows = lambda start, stop: decoded.append(stop - start) or get_rows(start, stop)
+    model.convertToMany(str(tmp_path), EXTENSIONS, use_processes=False)
+    assert sum(decoded) == model.geometry.nrows
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_convert_to_many_threads_follow_workers(isg_path, tmp_path, workers):
+    model = Model()
+    model.retrieveByPath(isg_path, lazy=True)
+    model.memory_budget = 20000
+    decoded = []
+    get_rows = model.lazy_grid.getRows
+    model.lazy_grid.getRows = lambda start, stop: decoded.append(stop - start) or get_rows(start, stop)
+    lock = threading.Lock()
+    running = [0]
+    most_running = [0]
+    convert_to = model.convertTo
+
+    def convertTo(path, extension, blocks=None, **options):
+        with lock:
+            running[0] += 1
+            most_running[0] = max(most_running[0], running[0])
+        try:
+            return convert_to(path, extension, blocks, **options)
+        finally:
+            with lock:
+                running[0] -= 1
+
+    model.convertTo = convertTo
+    outputs = model.convertToMany(str(tmp_path), EXTENSIONS, workers=workers, use_processes=False)
+    # The grid is walked once for each group of workers formats
+    assert sum(decoded) == model.geometry.nrows * math.ceil(len(EXTENSIONS) / workers)
+    assert most_running[0] == workers
+    assert {extension: digest(path) for extension, path in outputs.items()} == serial_digests(model, str(tmp_path))
+
+
+def test_convert_to_many_runs_text_formats_in_processes(isg_path, tmp_path, monkeypatch):
+    model = Model()
+    model.retrieveByPath(isg_path)
+    monkeypatch.setattr(Model, 'convertInThreads', lambda *args: pytest.fail('text formats converted in threads'))
+    outputs = model.convertToMany(str(tmp_path), ['gsf', 'csv'])
+    assert sorted(outputs) == ['csv', 'gsf']
+
+
+def test_convert_to_many_runs_binary_formats_in_threads(isg_path, tmp_path, monkeypatch):
+    model = Model()
+    model.retrieveByPath(isg_path)
+    monkeypatch.setattr('ISGFormatHandler.model.model.ProcessPoolExecutor', lambda *args, **kwargs: pytest.fail('binary formats converted in processes'))
+    outputs = model.convertToMany(str(tmp_path), ['gtx', 'bin'])
+    assert sorted(outputs) == ['bin', 'gtx']
+
+
+def test_convert_to_many_reports_a_failing_format(isg_path, tmp_path):
+    model = Model()
+    model.retrieveByPath(isg_path)
+    output = tmp_path / 'output'
+    output.mkdir()
+    with pytest.raises(ValueError):
+        model.convertToMany(str(output), ['isg2.00', 'unknown', 'gsf'], use_processes=False)
+    # The other formats are still written in full
+    assert sorted(digest(str(path)) for path in output.iterdir()) == \
+           sorted(digest(model.convertTo(str(tmp_path), extension)) for extension in ['isg2.00', 'gsf'])
@@ -0,0 +1,109 @@
+import hashlib
+import os
+import numpy as np
+import pytest
+
+from ISGFormatHandler.model import isg_parser
+from ISGFormatHandler.model.model import Model
+
+from conftest import write_isg
+
+EXPORTS = ['isg1.01', 'isg2.00', 'csv', 'gsf', 'gri', 'gtx', 'bin']
+SUBMODELS = {
+    'whole': {},
+    'bounds': {'bounds': {'lat_min': 41.1, 'lat_max': 44.3, 'lon_min': 6.2, 'lon_max': 11.9}},
+    'padded': {'bounds': {'lat_min': 39.0, 'lat_max': 46.0, 'lon_min': 4.0, 'lon_max': 13.0}, 'optimize_dimensions': False},
+    'nearest': {'interpolation': {'lat_deg': 0.1, 'lon_deg': 0.15, 'method': 'nn'}},
+    'bilinear': {'bounds': {'lat_min': 41.1, 'lat_max': 44.3, 'lon_min': 6.2, 'lon_max': 11.9},
+                 'interpolation': {'lat_deg': 0.07, 'lon_deg': 0.11, 'method': 'bl'}},
+    'bicubic': {'interpolation': {'lat_deg': 0.3, 'lon_deg': 0.4, 'method': 'bc'}},
+}
+
+
+def digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def open_models(path, memory_budget=20000):
+    eager = Model()
+    eager.retrieveByPath(path)
+    lazy = Model()
+    lazy.retrieveByPath(path, lazy=True)
+    # A tiny budget splits the streams into blocks of a few rows
+    lazy.memory_budget = memory_budget
+    return eager, lazy
+
+
+@pytest.fixture(params=['N-to-S, W-to-E', 'S-to-N, E-to-W'])
+def ordered_path(request, tmp_path, grid):
+    return write_isg(tmp_path / 'ordered.isg', grid, data_ordering=request.param)
+
+
+@pytest.mark.parametrize('submodel', SUBMODELS)
+def test_lazy_submodel_exports_match_eager(ordered_path, tmp_path, submodel):
+    eager, lazy = open_models(ordered_path)
+    eager = eager.getSubmodel(**SUBMODELS[submodel])
+    lazy = lazy.getSubmodel(**SUBMODELS[submodel])
+    assert lazy.isLazy()
+    for extension in EXPORTS:
+        assert digest(lazy.convertTo(str(tmp_path), extension)) == digest(eager.convertTo(str(tmp_path), extension)), extension
+    np.testing.assert_array_equal(lazy.data, eager.data)
+
+
+def test_lazy_tif_export_matches_eager(isg_path, tmp_path):
+    rasterio = pytest.importorskip('rasterio')
+    eager, lazy = open_models(isg_path)
+    for options in [{}, {'cog': True}, {'tiled': True, 'blocksize': 16, 'compress': 'deflate'}]:
+        arrays = []
+        for model in [eager, lazy]:
+            with rasterio.open(model.convertTo(str(tmp_path), 'tif', **options)) as dataset:
+                arrays.append(dataset.read(1))
+        np.testing.assert_array_equal(arrays[0], arrays[1])
+    assert not [name for name in os.listdir(tmp_path) if 'staging' in name]
+
+
+def test_lazy_model_decodes_only_on_data(isg_path, grid):
+    model = Model()
+    model.retrieveByPath(isg_path, lazy=True)
+    window = model.getWindow(2, 9, 4, 20)
+    assert model.isLazy() and window.isLazy()
+    np.testing.assert_array_equal(window.data, grid[2:9, 4:20])
+    # Decoding the parent does not close the file its windows still read
+    np.testing.assert_array_equal(model.data, grid)
+    np.testing.assert_array_equal(model.getWindow(3, 5, 0, 4).data, grid[3:5, :4])
+
+
+@pytest.mark.parametrize('data_ordering', ['N-to-S, W-to-E', 'S-to-N, E-to-W'])
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+def test_lazy_windows_decode_fixed_width(tmp_path, grid, monkeypatch, data_ordering, newline):
+    path = write_isg(tmp_path / 'model.isg', grid, data_ordering=data_ordering)
+    with open(path, 'rb') as f:
+        content = f.read()
+    with open(path, 'wb') as f:
+        f.write(content.replace(b'\n', newline.encode('utf8')))
+    decoded = []
+
+    def decode_fixed_width(raw, out, touching_cells=False):
+        decoded.append(fixed_width(raw, out, touching_cells))
+        return decoded[-1]
+
+    fixed_width = isg_parser.decode_fixed_width
+    monkeypatch.setattr(isg_parser, 'decode_fixed_width', decode_fixed_width)
+    model = Model()
+    model.retrieveByPath(path, lazy=True)
+    model.memory_budget = 20000
+    np.testing.assert_array_equal(model.getWindow(20, 21, 0, 31).data, grid[20:])
+    np.testing.assert_array_equal(np.concatenate([block for _, block in model.iterRowBlocks()]), grid)
+    assert model.getValueAtPoint(10, 12) == grid[10, 12]
+    assert len(decoded) > 3 and all(decoded)
+
+
+@pytest.mark.parametrize('use_processes', [False, True])
+def test_convert_to_many_on_lazy_model(isg_path, tmp_path, use_processes):
+    eager, lazy = open_models(isg_path)
+    submodel = SUBMODELS['bilinear']
+    outputs = lazy.getSubmodel(**submodel).convertToMany(str(tmp_path), ['isg2.00', 'gtx', 'csv'], use_processes=use_processes)
+    expected = eager.getSubmodel(**submodel).convertToMany(str(tmp_path), ['isg2.00', 'gtx', 'csv'])
+    assert {extension: digest(path) for extension, path in outputs.items()} == \
+           {extension: digest(path) for extension, path in expected.items()}
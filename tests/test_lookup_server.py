@@ -0,0 +1,110 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import pytest
+
+from ISGFormatHandler.service.lookup_server import LookupServer
+from ISGFormatHandler.service.model_pool import ModelPool
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def can_connect(port):
+    try:
+        socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+        return True
+    except OSError:
+        return False
+
+
+async def exchange(port, messages):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    responses = []
+    for message in messages:
+        writer.write((json.dumps(message) + '\n').encode('utf8'))
+        await writer.drain()
+        responses.append(json.loads(await reader.readline()))
+    writer.close()
+    return responses
+
+
+def test_unreadable_model_is_answered_with_an_error(isg_path, tmp_path):
+    pool = ModelPool({'model': isg_path, 'missing': str(tmp_path / 'missing.isg')})
+    port = free_port()
+
+    async def run():
+        server = asyncio.ensure_future(LookupServer(pool).serve(port=port))
+        await asyncio.sleep(0.2)
+        try:
+            return await exchange(port, [
+                {'id': 1, 'model': 'missing', 'lats': [42.0], 'lons': [8.0]},
+                {'id': 2, 'model': 'model', 'lats': [42.0, 30.0], 'lons': [8.0, 8.0], 'heights': [300.0, 300.0]},
+            ])
+        finally:
+            server.cancel()
+
+    missing, sampled = asyncio.run(run())
+    assert missing['id'] == 1 and 'error' in missing
+    assert sampled['id'] == 2 and sampled['undulations'][1] is None
+    assert sampled['orthometric_heights'][0] == pytest.approx(300.0 - sampled['undulations'][0])
+
+
+@pytest.mark.skipif(not hasattr(socket, 'SO_REUSEPORT'), reason='several workers need SO_REUSEPORT')
+def test_sigterm_stops_the_workers(isg_path):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'ISGFormatHandler.service.lookup_server', isg_path, '--port', str(port), '--workers', '2'],
+        cwd=ROOT, stdout=subprocess.DEVNULL
+    )
+    try:
+        deadline = time.monotonic() + 60
+        while not can_connect(port):
+            assert server.poll() is None and time.monotonic() < deadline
+            time.sleep(0.2)
+        server.terminate()
+        server.wait(timeout=30)
+        # Nothing may keep serving on the port once the parent is gone
+        assert not can_connect(port)
+    finally:
+        server.kill()
+
+
+def test_oversized_request_is_answered_with_an_error(isg_path, monkeypatch):
+    monkeypatch.setattr('ISGFormatHandler.service.lookup_server.MAX_REQUEST_SIZE', 1024)
+    port = free_port()
+
+    async def run():
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        server = asyncio.ensure_future(LookupServer(ModelPool({'model': isg_path})).serve(port=port))
+        await asyncio.sleep(0.2)
+        try:
+            answered = await exchange(port, [{'id': 1, 'model': 'model', 'lats': [42.0], 'lons': [8.0]}])
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            request = {'id': 2, 'model': 'model', 'lats': [42.0] * 2000, 'lons': [8.0] * 2000}
+            writer.write((json.dumps(request) + '\n').encode('utf8'))
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            closed = await reader.read()
+            writer.close()
+            # Errors logged once the handler has finished; cancelling the server below logs its own
+            await asyncio.sleep(0.2)
+            return answered[0], response, closed, list(errors)
+        finally:
+            server.cancel()
+
+    answered, response, closed, errors = asyncio.run(run())
+    assert answered['undulations'][0] is not None
+    assert 'longer than 1024 bytes' in response['error']
+    assert closed == b''
+    assert not errors
@@ -0,0 +1,104 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from ISGFormatHandler.model import model as model_module
+from ISGFormatHandler.model.model import Model
+from ISGFormatHandler.model.model_cache import cache_paths
+
+from conftest import write_isg
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    # Counts the grids parsed from the ISG text, i.e. the cache misses
+    calls = []
+    parse_data_section = model_module.parse_data_section
+    monkeypatch.setattr(model_module, 'parse_data_section', lambda *args: calls.append(args[1:3]) or parse_data_section(*args))
+    return calls
+
+
+def load(path, cache_dir=None):
+    model = Model()
+    model.retrieveByPath(path, cache=True, cache_dir=cache_dir)
+    return model
+
+
+@pytest.mark.parametrize('in_cache_dir', [False, True])
+def test_cache_is_written_and_reused(isg_path, tmp_path, grid, parsed, in_cache_dir):
+    cache_dir = str(tmp_path / 'cache') if in_cache_dir else None
+    first = load(isg_path, cache_dir)
+    assert all(os.path.exists(path) for path in cache_paths(isg_path, cache_dir))
+    second = load(isg_path, cache_dir)
+    assert len(parsed) == 1
+    np.testing.assert_array_equal(second.data, grid)
+    assert second.geometry == first.geometry
+    assert second.head == first.head
+
+
+def test_changed_size_invalidates_the_cache(isg_path, grid, parsed):
+    load(isg_path)
+    changed = grid.copy()
+    changed[5, 5] = 1000.5
+    write_isg(isg_path, np.vstack([changed, changed[-1:]]))
+    np.testing.assert_array_equal(load(isg_path).data[:-1], changed)
+    assert len(parsed) == 2
+
+
+def test_touched_source_with_the_same_content_hits_the_cache(isg_path, grid, parsed):
+    load(isg_path)
+    stat = os.stat(isg_path)
+    os.utime(isg_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    np.testing.assert_array_equal(load(isg_path).data, grid)
+    assert len(parsed) == 1
+    # The new mtime is recorded, so the next load does not hash the source again
+    with open(cache_paths(isg_path)[0], encoding='utf8') as f:
+        assert json.load(f)['source']['mtime_ns'] == stat.st_mtime_ns + 10 ** 9
+
+
+def test_changed_content_of_the_same_size_invalidates_the_cache(isg_path, grid, parsed):
+    load(isg_path)
+    stat = os.stat(isg_path)
+    changed = grid.copy()
+    changed[5, 5] += 1
+    write_isg(isg_path, changed)
+    os.utime(isg_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert os.path.getsize(isg_path) == stat.st_size
+    np.testing.assert_array_equal(load(isg_path).data, changed)
+    assert len(parsed) == 2
+
+
+@pytest.mark.parametrize('corrupt', [
+    lambda meta: '{"cache_version": 2, "dtype"',
+    lambda meta: json.dumps([meta]),
+    lambda meta: json.dumps({key: value for key, value in meta.items() if key != 'source'}),
+    lambda meta: json.dumps({key: value for key, value in meta.items() if key != 'head'}),
+    lambda meta: json.dumps({key: value for key, value in meta.items() if key not in ['geometry', 'isg_model_format']}),
+    lambda meta: json.dumps(dict(meta, geometry=meta['geometry'][:5])),
+    lambda meta: json.dumps(dict(meta, geometry=None)),
+    lambda meta: json.dumps(dict(meta, source={'size': meta['source']['size']})),
+    lambda meta: json.dumps(dict(meta, head={'nrows': {'value': 'many'}})),
+], ids=['truncated', 'list', 'no source', 'no head', 'no geometry', 'short geometry', 'null geometry', 'no mtime', 'bad head'])
+def test_corrupt_sidecar_is_a_cache_miss(isg_path, grid, parsed, corrupt):
+    model = load(isg_path)
+    meta_path = cache_paths(isg_path)[0]
+    with open(meta_path, encoding='utf8') as f:
+        meta = json.load(f)
+    with open(meta_path, 'w', encoding='utf8') as f:
+        f.write(corrupt(meta))
+    reloaded = load(isg_path)
+    np.testing.assert_array_equal(reloaded.data, grid)
+    assert reloaded.geometry == model.geometry
+    assert len(parsed) == 2
+    # The miss rewrites the sidecar, which the next load uses
+    load(isg_path)
+    assert len(parsed) == 2
+
+
+def test_missing_grid_file_is_a_cache_miss(isg_path, grid, parsed):
+    load(isg_path)
+    os.remove(cache_paths(isg_path)[1])
+    np.testing.assert_array_equal(load(isg_path).data, grid)
+    assert len(parsed) == 2
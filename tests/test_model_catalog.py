@@ -0,0 +1,60 @@
+import os
+import numpy as np
+
+from ISGFormatHandler.model.config import NODATA_VALUE
+from ISGFormatHandler.service.model_catalog import ModelCatalog
+
+from conftest import GAP, make_grid, write_isg
+
+
+def write_models(directory):
+    # A coarse model and a finer one covering part of it
+    grid = make_grid()
+    write_isg(directory / 'coarse.isg', grid, version='1.01')
+    fine = np.where(grid[:9, :9] == NODATA_VALUE, NODATA_VALUE, grid[:9, :9] + 1)
+    fine[4, 6] = NODATA_VALUE
+    fine_path = write_isg(directory / 'fine.isg', fine)
+    with open(fine_path) as f:
+        text = f.read()
+    text = text.replace('delta lat      = 0.250000', 'delta lat      = 0.125000')
+    text = text.replace('delta lon      = 0.250000', 'delta lon      = 0.125000')
+    text = text.replace('lat min        = 40.000000', 'lat min        = 44.000000')
+    text = text.replace('lon max        = 12.500000', 'lon max        = 6.000000')
+    with open(fine_path, 'w') as f:
+        f.write(text)
+    return grid, fine
+
+
+def test_catalog_routes_to_the_finest_covering_model(tmp_path):
+    write_models(tmp_path)
+    catalog = ModelCatalog.fromDirectory(str(tmp_path))
+    assert catalog.getNames() == ['fine', 'coarse']
+    assert catalog.findModel(44.5, 5.5).name == 'fine'
+    assert catalog.findModel(41.0, 10.0).name == 'coarse'
+    assert catalog.findModel(30.0, 10.0) is None
+    # Longitudes a turn away are routed the same way
+    np.testing.assert_array_equal(catalog.route([44.5, 41.0, 30.0], [365.5, 10.0 - 360, 10.0]), [0, 1, -1])
+
+
+def test_catalog_sample_falls_back_and_writes_no_cache(tmp_path):
+    grid, fine = write_models(tmp_path)
+    catalog = ModelCatalog.fromDirectory(str(tmp_path))
+    lat_gap = 45.0 - GAP[0] * 0.25
+    lon_gap = 5.0 + GAP[1] * 0.25
+    # Fine node, coarse node, nodata in the fine model only (falls back), nodata in both, outside both
+    values, sources = catalog.sample([44.875, 42.0, 44.5, lat_gap, 30.0], [5.5, 8.0, 5.75, lon_gap, 8.0])
+    np.testing.assert_allclose(values[:3], [fine[1, 4], grid[12, 12], grid[2, 3]])
+    assert values[3] == NODATA_VALUE and values[4] == NODATA_VALUE
+    np.testing.assert_array_equal(sources, [0, 1, 1, -1, -1])
+    assert sorted(os.listdir(tmp_path)) == ['coarse.isg', 'fine.isg']
+
+
+def test_catalog_caches_in_cache_dir_only(tmp_path):
+    models = tmp_path / 'models'
+    models.mkdir()
+    write_models(models)
+    cache_dir = tmp_path / 'cache'
+    catalog = ModelCatalog.fromDirectory(str(models), cache_dir=str(cache_dir))
+    catalog.sample([44.5, 42.0], [5.5, 8.0])
+    assert sorted(os.listdir(models)) == ['coarse.isg', 'fine.isg']
+    assert len(os.listdir(cache_dir)) == 4
@@ -0,0 +1,91 @@
+import io
+
+import numpy as np
+import pytest
+from conftest import make_grid, write_isg
+
+from ISGFormatHandler.converter.file_format import blockToString
+from ISGFormatHandler.model.isg_parser import parse_data_buffer, parse_data_lines, parse_data_section, read_head_section
+from ISGFormatHandler.model.model import Model
+
+
+def reference(text, nrows, ncols):
+    # What the line-by-line parser read: one float() per token
+    return np.array([float(token) for token in text.split()]).reshape(nrows, ncols)
+
+
+def layouts(grid):
+    fixed = blockToString(grid, ':10.4f', True)
+    wrapped = ''.join(
+        ' '.join('{:.4f}'.format(value) for value in row[:20]) + '\n' + ' '.join('{:.4f}'.format(value) for value in row[20:]) + '\n'
+        for row in grid
+    )
+    return {
+        'fixed width': fixed,
+        'crlf': fixed.replace('\n', '\r\n'),
+        'trailing blank lines': fixed + '\n  \n',
+        'wrapped rows': wrapped,
+        'exponents': ''.join(' '.join('{:.6e}'.format(value) for value in row) + '\n' for row in grid),
+        'ragged spacing': ''.join('  '.join('{:g}'.format(value) for value in row) + ' \n' for row in grid),
+        'explicit signs': ''.join(' '.join('{:+.4f}'.format(value) for value in row) + '\n' for row in grid),
+    }
+
+
+@pytest.mark.parametrize('layout', list(layouts(make_grid())))
+def test_bulk_parser_matches_line_parser(grid, layout):
+    text = layouts(grid)[layout]
+    expected = reference(text, *grid.shape)
+    np.testing.assert_array_equal(parse_data_buffer(text.encode('utf8'), *grid.shape), expected)
+    np.testing.assert_array_equal(parse_data_section(io.BytesIO(text.encode('utf8')), *grid.shape), expected)
+    np.testing.assert_array_equal(parse_data_lines(text.splitlines(keepends=True), *grid.shape), expected)
+
+
+def test_bulk_parser_reads_touching_cells(grid):
+    # GRI writes '%10.4f' back to back, so a wide negative value touches the one before it
+    values = np.where(grid < -9000, grid, -grid * 30)
+    text = ''.join(''.join('{:10.4f}'.format(value) for value in row) + '\n' for row in values)
+    expected = np.array([[float(line[i:i + 10]) for i in range(0, len(line), 10)] for line in text.splitlines()])
+    assert np.any([' ' not in line for line in text.splitlines()])
+    np.testing.assert_array_equal(parse_data_buffer(text.encode('utf8'), *grid.shape, touching_cells=True), expected)
+
+
+def test_bulk_parser_keeps_float32(grid):
+    text = blockToString(grid, ':10.4f', True).encode('utf8')
+    parsed = parse_data_buffer(text, *grid.shape, dtype=np.float32)
+    assert parsed.dtype == np.float32
+    np.testing.assert_array_equal(parsed, grid.astype(np.float32))
+
+
+@pytest.mark.parametrize('nrows', [20, 22])
+def test_shape_mismatch_raises(grid, nrows):
+    text = blockToString(grid, ':10.4f', True).encode('utf8')
+    with pytest.raises(ValueError, match='header declares nrows x ncols = {} x 31'.format(nrows)):
+        parse_data_buffer(text, nrows, grid.shape[1])
+
+
+def test_non_numeric_data_raises(grid):
+    text = blockToString(grid, ':10.4f', True).replace('40.', 'ab.', 1).encode('utf8')
+    with pytest.raises(ValueError, match='non-numeric'):
+        parse_data_buffer(text, *grid.shape)
+
+
+def test_missing_end_of_head_raises():
+    with pytest.raises(ValueError, match='end_of_head'):
+        read_head_section(io.BytesIO(b'begin_of_head ===\nnrows = 2\n'))
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+@pytest.mark.parametrize('nrows', [20, 22])
+def test_header_row_count_mismatch_raises(tmp_path, grid, lazy, nrows):
+    path = write_isg(tmp_path / 'model.isg', grid, nrows=nrows)
+    model = Model()
+    with pytest.raises(ValueError, match='header declares'):
+        model.importFrom(path, lazy=lazy)
+        model.data
+
+
+@pytest.mark.parametrize('data_ordering', ['N-to-S, W-to-E', 'S-to-N, W-to-E', 'N-to-S, E-to-W', 'S-to-N, E-to-W'])
+def test_data_ordering_is_standardized(tmp_path, grid, data_ordering):
+    model = Model()
+    model.importFrom(write_isg(tmp_path / 'model.isg', grid, data_ordering=data_ordering))
+    np.testing.assert_array_equal(model.data, grid)
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from ISGFormatHandler.converter.file_reader import FileReader
+from ISGFormatHandler.model.config import NODATA_VALUE
+from ISGFormatHandler.model.grid_geometry import GridGeometry
+from ISGFormatHandler.model.model import Model
+
+
+def grid_model(lon_min, lon_max, ncols=25, nrows=9, lat_min=-10.0, lat_max=10.0):
+    geometry = GridGeometry(
+        lat_min, lat_max, lon_min, lon_max, (lat_max - lat_min) / (nrows - 1), (lon_max - lon_min) / (ncols - 1), nrows, ncols
+    )
+    data = np.round(np.add.outer(np.linspace(30, 40, nrows), np.linspace(0, 5, ncols)), 4)
+    data[3, 4] = NODATA_VALUE
+    model = Model()
+    FileReader(model, 'grid.isg').setGrid(data, geometry)
+    return model
+
+
+def round_trip(model, tmp_path, extension, read_extension=None, **options):
+    path = model.convertTo(str(tmp_path), extension, **options)
+    read = Model()
+    read.importFrom(path, read_extension or extension)
+    return read
+
+
+@pytest.mark.parametrize('lon_min, lon_max', [(5.0, 17.0), (-10.0, 20.0), (-30.0, -6.0), (0.0, 360.0), (-180.0, 180.0), (170.0, 194.0)])
+def test_gsf_round_trip_keeps_longitudes(tmp_path, lon_min, lon_max):
+    model = grid_model(lon_min, lon_max)
+    read = round_trip(model, tmp_path, 'gsf')
+    assert read.geometry.lon_max > read.geometry.lon_min
+    # The longitudes may come back a whole turn apart
+    assert (read.geometry.lon_min - lon_min) % 360 == pytest.approx(0, abs=1e-9)
+    assert read.geometry.lon_max - read.geometry.lon_min == pytest.approx(lon_max - lon_min)
+    np.testing.assert_allclose(read.data, model.data)
+
+
+def test_gsf_round_trip_of_global_grid_samples(tmp_path):
+    read = round_trip(grid_model(0.0, 360.0, ncols=49), tmp_path, 'gsf')
+    assert read.sample(0.0, 352.5).item() != NODATA_VALUE
+
+
+def test_gtx_round_trip_keeps_values_near_the_nodata_value(tmp_path):
+    # GTX writes nodata as -88.8888 in float32; undulations a fraction of a millimetre away are real values
+    model = grid_model(5.0, 17.0)
+    data = model.data.copy()
+    data[1, :3] = [-88.8885, -88.8891, -88.8880]
+    model.data = data
+    read = round_trip(model, tmp_path, 'gtx')
+    np.testing.assert_allclose(read.data[1, :3], [-88.8885, -88.8891, -88.8880], atol=1e-4)
+    assert read.data[3, 4] == NODATA_VALUE
+    np.testing.assert_allclose(read.data, data, atol=1e-5)
+
+
+@pytest.mark.parametrize('extension, read_extension, atol', [
+    ('isg1.01', 'isg', 0), ('isg2.00', 'isg', 0), ('gri', None, 0), ('gsf', None, 0), ('tif', None, 1e-4),
+    ('gtx', None, 1e-4), ('bin', None, 1e-4),
+])
+@pytest.mark.parametrize('lazy', [False, True])
+def test_round_trip(tmp_path, isg_path, grid, extension, read_extension, atol, lazy):
+    model = Model()
+    model.retrieveByPath(isg_path, lazy=lazy)
+    read = round_trip(model, tmp_path, extension, read_extension)
+    assert read.geometry.shape == grid.shape
+    for slug in ['lat_min', 'lat_max', 'lon_min', 'lon_max', 'delta_lat', 'delta_lon']:
+        assert getattr(read.geometry, slug) == pytest.approx(getattr(model.geometry, slug), abs=1e-6)
+    np.testing.assert_array_equal(read.data < -9000, grid < -9000)
+    np.testing.assert_allclose(read.data, grid, rtol=0, atol=atol)
+
+
+def test_tif_window_read(tmp_path, isg_path, grid):
+    model = Model()
+    model.retrieveByPath(isg_path)
+    bounds = {'lat_min': 41.1, 'lat_max': 44.3, 'lon_min': 6.2, 'lon_max': 11.9}
+    window = Model()
+    window.importFrom(model.convertTo(str(tmp_path), 'tif'), bounds=bounds)
+    expected = model.getSubsetByBounds(bounds)
+    assert window.geometry.shape == expected.geometry.shape
+    np.testing.assert_allclose(window.data, expected.data, rtol=0, atol=1e-4)
+
+
+@pytest.mark.parametrize('nrows, ncols', [(1, 25), (9, 1)])
+def test_gsf_without_spacing_raises(tmp_path, nrows, ncols):
+    geometry = GridGeometry(-10.0, -10.0 + 2.5 * (nrows - 1), 5.0, 5.0 + 0.5 * (ncols - 1), 2.5, 0.5, nrows, ncols)
+    model = Model()
+    FileReader(model, 'grid.isg').setGrid(np.full((nrows, ncols), 30.0), geometry)
+    path = model.convertTo(str(tmp_path), 'gsf')
+    with pytest.raises(ValueError, match='no spacing'):
+        Model().importFrom(path)
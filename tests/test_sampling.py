@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from ISGFormatHandler.model.config import NODATA_VALUE
+from ISGFormatHandler.model.model import Model
+from ISGFormatHandler.model.sampling import SAMPLE_METHODS
+
+from conftest import GAP
+
+
+@pytest.fixture
+def model(isg_path):
+    model = Model()
+    model.retrieveByPath(isg_path)
+    return model
+
+
+@pytest.mark.parametrize('method', SAMPLE_METHODS)
+def test_sample_at_nodes_returns_node_values(model, grid, method):
+    rows, cols = np.meshgrid(np.arange(grid.shape[0]), np.arange(grid.shape[1]), indexing='ij')
+    coord = model.getCoordAtPoint(rows.ravel(), cols.ravel())
+    np.testing.assert_allclose(model.sample(coord['lat'], coord['lon'], method), grid.ravel(), atol=1e-9)
+
+
+@pytest.mark.parametrize('method', SAMPLE_METHODS)
+def test_sample_next_to_gap_keeps_valid_nodes(model, grid, method):
+    # Neighbours of the gap, including the last row and column of the bilinear cells ending at it
+    row, col = GAP
+    neighbours = [(row - 1, col), (row, col - 1), (row - 1, col - 1), (row + 1, col), (row, col + 1)]
+    coord = model.getCoordAtPoint(np.array([r for r, c in neighbours]), np.array([c for r, c in neighbours]))
+    values = model.sample(coord['lat'], coord['lon'], method)
+    np.testing.assert_allclose(values, [grid[r, c] for r, c in neighbours], atol=1e-9)
+
+
+@pytest.mark.parametrize('method', ['bilinear', 'bicubic'])
+def test_sample_between_nodes_next_to_gap_is_nodata(model, method):
+    coord = model.getCoordAtPoint(GAP[0] - 0.5, GAP[1] - 0.5)
+    assert model.sample(coord['lat'], coord['lon'], method) == NODATA_VALUE
+
+
+def test_bicubic_next_to_gap_falls_back_to_bilinear(model):
+    # One cell away from the gap the 4x4 stencil is incomplete, the 2x2 one is not
+    coord = model.getCoordAtPoint(GAP[0] - 1.5, GAP[1] - 0.5)
+    bicubic = model.sample(coord['lat'], coord['lon'], 'bicubic')
+    assert bicubic == model.sample(coord['lat'], coord['lon'], 'bilinear')
+    assert bicubic != NODATA_VALUE
+
+
+def test_sample_matches_scipy(model, grid):
+    interpolate = pytest.importorskip('scipy.interpolate')
+    rng = np.random.default_rng(0)
+    rows = rng.uniform(1, 8, 200)
+    cols = rng.uniform(3, 28, 200)
+    coord = model.getCoordAtPoint(rows, cols)
+    expected = interpolate.RegularGridInterpolator((np.arange(grid.shape[0]), np.arange(grid.shape[1])), grid)((rows, cols))
+    np.testing.assert_allclose(model.sample(coord['lat'], coord['lon'], 'bilinear'), expected, atol=1e-9)
+
+
+def test_sample_outside_grid_is_nodata(model):
+    assert model.sample(39.0, 8.0).item() == NODATA_VALUE
+
+
+def test_sample_rejects_unknown_method(model):
+    with pytest.raises(ValueError):
+        model.sample(42.0, 8.0, 'spline')
+
+
+@pytest.mark.parametrize('method', ['nearest', 'linear', 'cubic'])
+def test_interpolate_onto_finer_grid_keeps_source_nodes(model, grid, method):
+    # Every source node is also a target node: only the gap itself may become nodata there
+    model.interpolate(0.125, 0.125, method)
+    assert model.geometry.shape == (41, 61)
+    np.testing.assert_allclose(model.data[::2, ::2], grid, atol=1e-9)
+
+
+@pytest.mark.parametrize('method', ['linear', 'cubic'])
+def test_interpolate_masks_targets_using_the_gap(model, method):
+    model.interpolate(0.125, 0.125, method)
+    row, col = 2 * GAP[0], 2 * GAP[1]
+    assert model.data[row - 1, col] == NODATA_VALUE
+    assert model.data[row, col + 1] == NODATA_VALUE
+    assert model.data[row - 2, col - 2] != NODATA_VALUE
+
+
+@pytest.mark.parametrize('method', ['bilinear', 'bicubic'])
+def test_sample_grid_matches_point_sampling(model, method):
+    lats = np.linspace(40.1, 44.9, 37)
+    lons = np.linspace(5.1, 12.4, 53)
+    lat_grid, lon_grid = np.meshgrid(lats, lons, indexing='ij')
+    np.testing.assert_allclose(model.sampleGrid(lats, lons, method), model.sample(lat_grid, lon_grid, method), atol=1e-9)
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+from conftest import DELTA, LAT_MAX, LAT_MIN, LON_MAX, LON_MIN, NCOLS, NROWS
+
+from ISGFormatHandler.model.config import NODATA_VALUE
+from ISGFormatHandler.model.grid_geometry import GridGeometry
+from ISGFormatHandler.model.model import Model
+
+GEOMETRY = GridGeometry(LAT_MIN, LAT_MAX, LON_MIN, LON_MAX, DELTA, DELTA, NROWS, NCOLS)
+BOUNDS = {
+    'on nodes': {'lat_min': 41.0, 'lat_max': 44.0, 'lon_min': 6.0, 'lon_max': 11.0},
+    'between nodes': {'lat_min': 41.1, 'lat_max': 44.3, 'lon_min': 6.2, 'lon_max': 11.9},
+    'rounded nodes': {'lat_min': 40.1 + 0.15, 'lat_max': 0.1 + 0.2 + 43.7, 'lon_min': 5.7 + 0.05, 'lon_max': 7.1 + 0.15},
+    'beyond the grid': {'lat_min': 39.0, 'lat_max': 46.0, 'lon_min': 4.0, 'lon_max': 13.0},
+    'one node': {'lat_min': 42.5, 'lat_max': 42.5, 'lon_min': 8.0, 'lon_max': 8.0},
+}
+
+
+def nodes_inside(bounds):
+    # The nodes a subset must keep, found by comparing every node coordinate with the bounds
+    lats = np.round(np.linspace(LAT_MAX, LAT_MIN, NROWS), 9)
+    lons = np.round(np.linspace(LON_MIN, LON_MAX, NCOLS), 9)
+    rows = np.flatnonzero((lats >= round(bounds['lat_min'], 9)) & (lats <= round(bounds['lat_max'], 9)))
+    cols = np.flatnonzero((lons >= round(bounds['lon_min'], 9)) & (lons <= round(bounds['lon_max'], 9)))
+    return rows, cols
+
+
+@pytest.fixture(params=[False, True], ids=['eager', 'lazy'])
+def model(request, isg_path):
+    model = Model()
+    model.retrieveByPath(isg_path, lazy=request.param)
+    return model
+
+
+@pytest.mark.parametrize('name', list(BOUNDS))
+def test_index_window_keeps_the_nodes_inside(name):
+    rows, cols = nodes_inside(BOUNDS[name])
+    assert GEOMETRY.getIndexWindow(BOUNDS[name]) == (rows[0], rows[-1] + 1, cols[0], cols[-1] + 1)
+
+
+@pytest.mark.parametrize('bounds', [
+    {'lat_min': 46.0, 'lat_max': 47.0, 'lon_min': 6.0, 'lon_max': 8.0},
+    {'lat_min': 41.0, 'lat_max': 42.0, 'lon_min': 13.0, 'lon_max': 14.0},
+    {'lat_min': 41.1, 'lat_max': 41.2, 'lon_min': 6.0, 'lon_max': 8.0},
+])
+def test_index_window_is_none_without_nodes(bounds):
+    assert GEOMETRY.getIndexWindow(bounds) is None
+
+
+@pytest.mark.parametrize('name', list(BOUNDS))
+def test_subset_by_bounds(model, grid, name):
+    rows, cols = nodes_inside(BOUNDS[name])
+    subset = model.getSubsetByBounds(BOUNDS[name])
+    assert subset.is_subset
+    np.testing.assert_array_equal(subset.data, grid[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1])
+    assert subset.dd_bounds['lat_max'] == pytest.approx(LAT_MAX - rows[0] * DELTA)
+    assert subset.dd_bounds['lat_min'] == pytest.approx(LAT_MAX - rows[-1] * DELTA)
+    assert subset.dd_bounds['lon_min'] == pytest.approx(LON_MIN + cols[0] * DELTA)
+    assert subset.dd_bounds['lon_max'] == pytest.approx(LON_MIN + cols[-1] * DELTA)
+    assert subset.head['nrows']['value'] == rows.size
+    assert subset.head['ncols']['value'] == cols.size
+    # The subset has its own header, so the source keeps its bounds
+    assert model.dd_bounds['lat_min'] == LAT_MIN
+
+
+def test_subset_outside_the_grid_is_none(model):
+    assert model.getSubsetByBounds({'lat_min': 46.0, 'lat_max': 47.0, 'lon_min': 6.0, 'lon_max': 8.0}) is None
+
+
+def test_window_of_a_window(model, grid):
+    window = model.getWindow(2, 18, 3, 25).getWindow(4, 9, 0, 7)
+    np.testing.assert_array_equal(window.data, grid[6:11, 3:10])
+    assert window.geometry.shape == (5, 7)
+    assert window.dd_bounds['lat_max'] == pytest.approx(LAT_MAX - 6 * DELTA)
+    assert window.dd_bounds['lon_max'] == pytest.approx(LON_MIN + 9 * DELTA)
+
+
+def test_eager_window_is_a_read_only_view(isg_path, grid):
+    model = Model()
+    model.retrieveByPath(isg_path)
+    window = model.getWindow(1, 5, 1, 5)
+    assert np.shares_memory(window.data, model.data)
+    with pytest.raises(ValueError):
+        window.data[0, 0] = 0
+
+
+def test_padded_grid(model, grid):
+    padded = model.getPadded(2, 1, 3, 4)
+    assert padded.geometry.shape == (NROWS + 3, NCOLS + 7)
+    assert padded.dd_bounds['lat_max'] == pytest.approx(LAT_MAX + 2 * DELTA)
+    assert padded.dd_bounds['lat_min'] == pytest.approx(LAT_MIN - DELTA)
+    assert padded.dd_bounds['lon_min'] == pytest.approx(LON_MIN - 3 * DELTA)
+    assert padded.dd_bounds['lon_max'] == pytest.approx(LON_MAX + 4 * DELTA)
+    assert padded.geometry.delta_lat == model.geometry.delta_lat
+    np.testing.assert_array_equal(padded.data[2:-1, 3:-4], grid)
+    border = padded.data.copy()
+    border[2:-1, 3:-4] = NODATA_VALUE
+    assert np.all(border == NODATA_VALUE)
+
+
+def test_submodel_without_optimized_dimensions_pads_to_the_bounds(model, grid):
+    # The grid is padded with nodata beyond its edges and then cut to the nodes inside the bounds
+    bounds = {'lat_min': 39.6, 'lat_max': 45.5, 'lon_min': 4.75, 'lon_max': 13.0}
+    submodel = model.getSubmodel(bounds=bounds, optimize_dimensions=False)
+    assert submodel.dd_bounds['lat_min'] == pytest.approx(39.75)
+    assert submodel.dd_bounds['lat_max'] == pytest.approx(45.5)
+    assert submodel.dd_bounds['lon_min'] == pytest.approx(4.75)
+    assert submodel.dd_bounds['lon_max'] == pytest.approx(13.0)
+    np.testing.assert_array_equal(submodel.data[2:-1, 1:-2], grid)
+    assert submodel.geometry.shape == (NROWS + 3, NCOLS + 3)